@@ -0,0 +1,148 @@
+from collections import deque
+from dotenv import load_dotenv
+import asyncio
+import json
+import os
+import time
+
+from . import route_classes
+
+load_dotenv()
+
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "1") == "1"
+RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+
+def _pool_setting(route_class: str, name: str, default):
+    return type(default)(os.getenv(f"ADMISSION_{route_class.upper()}_{name}", str(default)))
+
+class Pool:
+    """
+    Concurrency limit for one route class with a bounded FIFO wait queue
+
+    Requests beyond the limit wait in the queue for at most queue_timeout
+    seconds. When the queue is full or the wait runs out the request is
+    rejected instead of piling more latency onto everyone else.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.queued_total = 0
+        self._waiters = deque()
+
+    @classmethod
+    def from_env(cls, name: str, limit: int, max_queue: int, queue_timeout: float):
+        return cls(
+            name,
+            _pool_setting(name, "CONCURRENCY", limit),
+            _pool_setting(name, "QUEUE", max_queue),
+            _pool_setting(name, "QUEUE_TIMEOUT", queue_timeout)
+        )
+
+    async def acquire(self) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.rejected_queue_full += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued_total += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if waiter.done():
+                # The slot was handed over just as we were cancelled
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            waited = time.monotonic() - start
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+        if waiter.done():
+            # release() handed its slot over, active was left unchanged
+            self.admitted += 1
+            return True
+        self._waiters.remove(waiter)
+        self.rejected_timeout += 1
+        return False
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_seconds_avg": self.wait_seconds_total / self.queued_total if self.queued_total else 0.0,
+            "wait_seconds_max": self.wait_seconds_max
+        }
+
+def default_pools():
+    return {
+        # bcrypt verification is CPU bound, keep it from starving the loop
+        route_classes.AUTH: Pool.from_env(route_classes.AUTH, 8, 64, 2.0),
+        route_classes.READ: Pool.from_env(route_classes.READ, 256, 1024, 1.0),
+        route_classes.WRITE: Pool.from_env(route_classes.WRITE, 64, 256, 2.0),
+        route_classes.EXPORT: Pool.from_env(route_classes.EXPORT, 2, 4, 5.0),
+        route_classes.STREAM: Pool.from_env(route_classes.STREAM, 1000, 0, 0.0)
+    }
+
+pools = default_pools()
+
+class AdmissionMiddleware:
+    """Admits each request through the pool of its route class, or answers 503 with Retry-After"""
+
+    def __init__(self, app, pools: dict = pools, enabled: bool = ADMISSION_CONTROL_ENABLED):
+        self.app = app
+        self.pools = pools
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        pool = self.pools[route_classes.route_class(scope["method"], scope["path"])]
+        if not await pool.acquire():
+            body = json.dumps({"detail": "Server is busy, retry later"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(RETRY_AFTER_SECONDS).encode())
+                ]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            pool.release()
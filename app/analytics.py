@@ -0,0 +1,270 @@
+"""
+Columnar snapshot of the numeric product fields for catalog analytics
+
+The snapshot holds one NumPy array per field, sorted by product id, and is
+read from a secondary when one is available. After the initial load only
+products whose updated_at moved past the last seen value are fetched and
+merged in. Deletes (including archival) leave no trace in updated_at, so
+the snapshot is rebuilt when the collection holds fewer products than it
+does, and in full every ANALYTICS_FULL_REFRESH_SECONDS regardless.
+Queries run entirely on the arrays and never touch MongoDB.
+"""
+
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from pymongo import ReadPreference
+from typing import Optional
+import asyncio
+import logging
+import numpy as np
+import os
+import time
+
+load_dotenv()
+
+ANALYTICS_ENABLED = os.getenv("ANALYTICS_ENABLED", "1") == "1"
+ANALYTICS_REFRESH_SECONDS = float(os.getenv("ANALYTICS_REFRESH_SECONDS", "30"))
+ANALYTICS_FULL_REFRESH_SECONDS = float(os.getenv("ANALYTICS_FULL_REFRESH_SECONDS", "3600"))
+# Deltas start this far before the newest updated_at seen, so writes stamped
+# by a worker with a slightly late clock are not missed
+ANALYTICS_DELTA_OVERLAP_SECONDS = float(os.getenv("ANALYTICS_DELTA_OVERLAP_SECONDS", "5"))
+
+LOAD_CHUNK_SIZE = 10000
+
+PROJECTION = {"price": 1, "quantity": 1, "category_id": 1, "updated_at": 1}
+
+logger = logging.getLogger(__name__)
+
+class Columns:
+    """Equal-length arrays, one row per product, sorted by id"""
+
+    def __init__(self, ids, price, quantity, category, updated_at):
+        self.ids = ids
+        self.price = price
+        self.quantity = quantity
+        self.category = category
+        self.updated_at = updated_at
+
+    def __len__(self):
+        return len(self.ids)
+
+    def sorted(self):
+        order = np.argsort(self.ids, kind="stable")
+        return Columns(*(column[order] for column in self._arrays()))
+
+    def _arrays(self):
+        return (self.ids, self.price, self.quantity, self.category, self.updated_at)
+
+class ProductSnapshot:
+    def __init__(self):
+        self.columns = None
+        self.categories = []
+        self._category_codes = {}
+        self.watermark = None
+        self.loaded_at = None
+        self.refreshed_at = None
+        self.deltas_applied = 0
+        self._task = None
+
+    @property
+    def ready(self):
+        return self.columns is not None
+
+    def category_code(self, category_id) -> int:
+        code = self._category_codes.get(category_id)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(category_id)
+            self._category_codes[category_id] = code
+        return code
+
+    def _columns(self, products) -> Columns:
+        return Columns(
+            np.array([product["_id"].binary for product in products], dtype="S12"),
+            np.array([product.get("price") or 0.0 for product in products], dtype=np.float64),
+            np.array([product.get("quantity") or 0 for product in products], dtype=np.int64),
+            np.array([self.category_code(product.get("category_id")) for product in products], dtype=np.int32),
+            np.array([product.get("updated_at") or datetime.min for product in products], dtype="datetime64[ms]")
+        )
+
+    @staticmethod
+    def _source(db):
+        return db.products.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+    async def load(self, db):
+        # Converted to columns every LOAD_CHUNK_SIZE products so the full
+        # collection is never held as dicts
+        chunks = []
+        products = []
+        watermark = None
+        async for product in self._source(db).find({}, PROJECTION).batch_size(LOAD_CHUNK_SIZE):
+            products.append(product)
+            updated_at = product.get("updated_at")
+            if updated_at and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+            if len(products) >= LOAD_CHUNK_SIZE:
+                chunks.append(self._columns(products))
+                products = []
+        chunks.append(self._columns(products))
+        self.columns = Columns(*(np.concatenate(arrays) for arrays in zip(*(chunk._arrays() for chunk in chunks)))).sorted()
+        self.watermark = watermark
+        self.loaded_at = self.refreshed_at = datetime.utcnow()
+
+    def merge(self, products):
+        """Insert or overwrite rows for the given products"""
+        delta = self._columns(products).sorted()
+        columns = self.columns
+        positions = np.searchsorted(columns.ids, delta.ids)
+        clipped = np.minimum(positions, max(len(columns) - 1, 0))
+        exists = (positions < len(columns)) & (columns.ids[clipped] == delta.ids) if len(columns) else np.zeros(len(delta), dtype=bool)
+
+        target = positions[exists]
+        columns.price[target] = delta.price[exists]
+        columns.quantity[target] = delta.quantity[exists]
+        columns.category[target] = delta.category[exists]
+        columns.updated_at[target] = delta.updated_at[exists]
+
+        new = ~exists
+        if new.any():
+            self.columns = Columns(*(
+                np.insert(column, positions[new], added[new])
+                for column, added in zip(columns._arrays(), delta._arrays())
+            ))
+
+    async def refresh(self, db):
+        """Apply the products changed since the last refresh"""
+        if not self.ready:
+            await self.load(db)
+            return
+        since = self.watermark - timedelta(seconds=ANALYTICS_DELTA_OVERLAP_SECONDS) if self.watermark else datetime.min
+        source = self._source(db)
+        products = await source.find({"updated_at": {"$gte": since}}, PROJECTION).to_list(None)
+        if products:
+            self.merge(products)
+            self.watermark = max(self.watermark or since, max(product["updated_at"] for product in products))
+            self.deltas_applied += 1
+        if await source.estimated_document_count() < len(self.columns):
+            await self.load(db)
+        self.refreshed_at = datetime.utcnow()
+
+    async def _refresh_loop(self, db):
+        last_full = time.monotonic()
+        while True:
+            try:
+                if self.ready and time.monotonic() - last_full > ANALYTICS_FULL_REFRESH_SECONDS:
+                    await self.load(db)
+                    last_full = time.monotonic()
+                else:
+                    await self.refresh(db)
+            except Exception as e:
+                logger.warning("Analytics snapshot refresh failed: %s", e)
+            await asyncio.sleep(ANALYTICS_REFRESH_SECONDS)
+
+    def start(self, db):
+        if ANALYTICS_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop(db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self):
+        return {
+            "enabled": ANALYTICS_ENABLED,
+            "ready": self.ready,
+            "rows": len(self.columns) if self.ready else 0,
+            "categories": len(self.categories),
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None,
+            "refreshed_at": self.refreshed_at.isoformat() if self.refreshed_at else None,
+            "deltas_applied": self.deltas_applied
+        }
+
+    # Queries
+
+    def category_mask(self, category_id) -> Optional[np.ndarray]:
+        """Row mask for one category, None for all rows"""
+        if category_id is None:
+            return None
+        code = self._category_codes.get(category_id)
+        if code is None:
+            return np.zeros(len(self.columns), dtype=bool)
+        return self.columns.category == code
+
+    def _select(self, column, mask):
+        return column if mask is None else column[mask]
+
+    def price_percentiles(self, percentiles, category_id=None):
+        prices = self._select(self.columns.price, self.category_mask(category_id))
+        values = np.percentile(prices, percentiles).tolist() if len(prices) else [None] * len(percentiles)
+        return {"count": len(prices), "percentiles": dict(zip((f"{p:g}" for p in percentiles), values))}
+
+    def histogram(self, field: str, bins: int, category_id=None, lower=None, upper=None):
+        """Raises ValueError when the range, after filling in the data bounds, is inverted"""
+        values = self._select(getattr(self.columns, field), self.category_mask(category_id))
+        if len(values):
+            lower = float(values.min()) if lower is None else lower
+            upper = float(values.max()) if upper is None else upper
+        else:
+            lower = lower if lower is not None else (upper if upper is not None else 0.0)
+            upper = upper if upper is not None else lower
+        if lower > upper:
+            raise ValueError(f"Histogram range is empty: min {lower:g} is above max {upper:g}")
+        if len(values):
+            counts, edges = np.histogram(values, bins=bins, range=(lower, upper))
+        else:
+            counts, edges = np.zeros(bins, dtype=np.int64), np.linspace(lower, upper, bins + 1)
+        return {"count": len(values), "edges": edges.tolist(), "counts": counts.tolist()}
+
+    def stock_by_category(self):
+        columns = self.columns
+        if not len(columns):
+            return []
+        order = np.argsort(columns.category, kind="stable")
+        codes = columns.category[order]
+        quantity = columns.quantity[order]
+        price = columns.price[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        counts = np.diff(np.r_[starts, len(codes)])
+        total = np.add.reduceat(quantity, starts)
+        out_of_stock = np.add.reduceat((quantity <= 0).astype(np.int64), starts)
+        stock_value = np.add.reduceat(quantity * price, starts)
+        return [
+            {
+                "category_id": self.categories[codes[start]],
+                "products": int(count),
+                "total_quantity": int(total_quantity),
+                "mean_quantity": float(total_quantity / count),
+                "min_quantity": int(minimum),
+                "max_quantity": int(maximum),
+                "out_of_stock": int(empty),
+                "stock_value": float(value)
+            }
+            for start, count, total_quantity, minimum, maximum, empty, value in zip(
+                starts, counts, total,
+                np.minimum.reduceat(quantity, starts),
+                np.maximum.reduceat(quantity, starts),
+                out_of_stock, stock_value
+            )
+        ]
+
+    def price_quantity_correlation(self, category_id=None):
+        mask = self.category_mask(category_id)
+        price = self._select(self.columns.price, mask)
+        quantity = self._select(self.columns.quantity, mask).astype(np.float64)
+        result = {"count": len(price), "pearson": None, "spearman": None}
+        if len(price) < 2 or price.std() == 0 or quantity.std() == 0:
+            return result
+        result["pearson"] = float(np.corrcoef(price, quantity)[0, 1])
+        # Spearman is Pearson on the ranks (ties broken by position)
+        price_rank = np.argsort(np.argsort(price, kind="stable"), kind="stable")
+        quantity_rank = np.argsort(np.argsort(quantity, kind="stable"), kind="stable")
+        result["spearman"] = float(np.corrcoef(price_rank, quantity_rank)[0, 1])
+        return result
+
+product_snapshot = ProductSnapshot()
@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from pymongo import DeleteOne, ReplaceOne
+import asyncio
+import contextvars
+import logging
+import os
+
+from .autocomplete import product_names
+from .query_cache import query_cache
+
+load_dotenv()
+
+# Background archival is off unless enabled; a pass can also be run on demand
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "0") == "1"
+# Products with quantity <= ARCHIVE_MAX_QUANTITY not updated for ARCHIVE_STALE_DAYS are cold
+ARCHIVE_MAX_QUANTITY = int(os.getenv("ARCHIVE_MAX_QUANTITY", "0"))
+ARCHIVE_STALE_DAYS = float(os.getenv("ARCHIVE_STALE_DAYS", "180"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+# Pause between batches so a pass does not monopolize the primary
+ARCHIVE_BATCH_PAUSE_SECONDS = float(os.getenv("ARCHIVE_BATCH_PAUSE_SECONDS", "0.5"))
+
+ARCHIVE_COLLECTION = "products_archive"
+
+logger = logging.getLogger(__name__)
+
+def cold_product_query(now: datetime = None):
+    cutoff = (now or datetime.utcnow()) - timedelta(days=ARCHIVE_STALE_DAYS)
+    return {"quantity": {"$lte": ARCHIVE_MAX_QUANTITY}, "updated_at": {"$lt": cutoff}}
+
+class Archiver:
+    """
+    Moves cold products from products into products_archive in batches
+
+    Each batch is copied to the archive first, then deleted from the hot
+    collection only if it is unchanged since it was read (same updated_at and
+    still cold). Products that were touched in between stay hot and their
+    archive copies are removed again, also when the batch fails halfway.
+    """
+
+    def __init__(self):
+        self.archived_total = 0
+        self.last_run = None
+        self._task = None
+        self._lock = asyncio.Lock()
+        self._detached = set()
+
+    def stats(self):
+        return {
+            "enabled": ARCHIVE_ENABLED,
+            "archived_total": self.archived_total,
+            "last_run": self.last_run.isoformat() if self.last_run else None
+        }
+
+    async def archive_batch(self, db, query: dict) -> int:
+        products = await db.products.find(query).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not products:
+            return 0
+        ids = [product["_id"] for product in products]
+        archived_at = datetime.utcnow()
+        try:
+            await db[ARCHIVE_COLLECTION].bulk_write([
+                ReplaceOne({"_id": product["_id"]}, {**product, "archived_at": archived_at}, upsert=True)
+                for product in products
+            ], ordered=False)
+            await db.products.bulk_write([
+                DeleteOne({**query, "_id": product["_id"], "updated_at": product["updated_at"]})
+                for product in products
+            ], ordered=False)
+        finally:
+            # However far the batch got, a product still in the hot collection
+            # must not keep an archive copy
+            still_hot = {product["_id"] async for product in db.products.find({"_id": {"$in": ids}}, {"_id": 1})}
+            if still_hot:
+                await db[ARCHIVE_COLLECTION].delete_many({"_id": {"$in": list(still_hot)}})
+
+        archived = [product for product in products if product["_id"] not in still_hot]
+        for product in archived:
+            product_names.remove(product["_id"], product["name"])
+        self.archived_total += len(archived)
+        return len(archived)
+
+    async def run_pass(self, db, max_batches: int = None) -> int:
+        async with self._lock:
+            query = cold_product_query()
+            archived = 0
+            batches = 0
+            completed = False
+            try:
+                while max_batches is None or batches < max_batches:
+                    moved = await self.archive_batch(db, query)
+                    batches += 1
+                    archived += moved
+                    if moved < ARCHIVE_BATCH_SIZE:
+                        break
+                    await asyncio.sleep(ARCHIVE_BATCH_PAUSE_SECONDS)
+                completed = True
+            finally:
+                if archived or not completed:
+                    # Archived products may sit on any cached listing page,
+                    # and a failed batch may have removed some already
+                    await query_cache.invalidate_all()
+                self.last_run = datetime.utcnow()
+            return archived
+
+    async def run_detached(self, db, max_batches: int = None) -> int:
+        """
+        Run a pass for a request: in a fresh context so it is not bound by the
+        request's Mongo deadline, and shielded so a disconnect does not stop
+        it between the copy and the delete of a batch
+        """
+        task = asyncio.create_task(self.run_pass(db, max_batches), context=contextvars.Context())
+        self._detached.add(task)
+        task.add_done_callback(self._detached.discard)
+        return await asyncio.shield(task)
+
+    async def restore(self, db, product_id):
+        """Move a product back into the hot collection, returns it or None"""
+        product = await db[ARCHIVE_COLLECTION].find_one({"_id": product_id})
+        if product is None:
+            return None
+        product.pop("archived_at", None)
+        product["updated_at"] = datetime.utcnow()
+        await db.products.replace_one({"_id": product_id}, product, upsert=True)
+        await db[ARCHIVE_COLLECTION].delete_one({"_id": product_id})
+        product_names.add(product_id, product["name"])
+        await query_cache.invalidate("all", f"category:{product['category_id']}")
+        return product
+
+    async def _loop(self, db):
+        while True:
+            try:
+                archived = await self.run_pass(db)
+                if archived:
+                    logger.info("Archived %d cold products", archived)
+            except Exception as e:
+                logger.warning("Archival pass failed: %s", e)
+            await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+    def start(self, db):
+        if ARCHIVE_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._loop(db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+archiver = Archiver()
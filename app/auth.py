@@ -4,6 +4,7 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from . import schemas
 from dotenv import load_dotenv
+import hashlib
 import os
 
 load_dotenv()
@@ -11,6 +12,7 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -29,3 +31,30 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+def password_fingerprint(hashed_password: str) -> str:
+    """Short digest of the stored hash, changes whenever the password does"""
+    return hashlib.sha256(hashed_password.encode()).hexdigest()[:16]
+
+def create_refresh_token(email: str, hashed_password: str):
+    expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    payload = {"sub": email, "type": "refresh", "pwv": password_fingerprint(hashed_password), "exp": expire}
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+def _decode(token: str) -> Optional[dict]:
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
+def decode_access_token(token: str) -> Optional[dict]:
+    payload = _decode(token)
+    if payload is None or payload.get("type") == "refresh":
+        return None
+    return payload
+
+def decode_refresh_token(token: str) -> Optional[dict]:
+    payload = _decode(token)
+    if payload is None or payload.get("type") != "refresh":
+        return None
+    return payload
@@ -0,0 +1,124 @@
+from bisect import bisect_left, bisect_right
+from bson import ObjectId
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+
+load_dotenv()
+
+# Full rebuilds pick up writes made by other workers and replicas
+AUTOCOMPLETE_REFRESH_SECONDS = float(os.getenv("AUTOCOMPLETE_REFRESH_SECONDS", "300"))
+
+logger = logging.getLogger(__name__)
+
+def normalize(name: str) -> str:
+    return " ".join(name.casefold().split())
+
+class PrefixIndex:
+    """
+    Product names kept as a sorted array of normalized keys, with parallel
+    arrays for the display name and the 12-byte product ID
+
+    A lookup is a binary search for the prefix followed by reading the next
+    `limit` entries. Display names share the key string when normalizing
+    does not change them, so most names are stored once.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.names = []
+        self.ids = []
+        self.loaded = False
+        self._pending = None
+        self._refresh_task = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _add(self, product_id: bytes, name: str):
+        key = normalize(name)
+        start, index = bisect_left(self.keys, key), bisect_right(self.keys, key)
+        if product_id in self.ids[start:index]:
+            return
+        self.keys.insert(index, key)
+        self.names.insert(index, key if key == name else name)
+        self.ids.insert(index, product_id)
+
+    def _remove(self, product_id: bytes, name: str):
+        key = normalize(name)
+        for index in range(bisect_left(self.keys, key), bisect_right(self.keys, key)):
+            if self.ids[index] == product_id:
+                del self.keys[index], self.names[index], self.ids[index]
+                return
+
+    def add(self, product_id: ObjectId, name: str):
+        if self._pending is not None:
+            self._pending.append((self._add, product_id.binary, name))
+        self._add(product_id.binary, name)
+
+    def remove(self, product_id: ObjectId, name: str):
+        if self._pending is not None:
+            self._pending.append((self._remove, product_id.binary, name))
+        self._remove(product_id.binary, name)
+
+    def rename(self, product_id: ObjectId, old_name: str, new_name: str):
+        if old_name != new_name:
+            self.remove(product_id, old_name)
+            self.add(product_id, new_name)
+
+    def search(self, prefix: str, limit: int = 10):
+        key = normalize(prefix)
+        index = bisect_left(self.keys, key)
+        results = []
+        keys = self.keys
+        while index < len(keys) and len(results) < limit and keys[index].startswith(key):
+            results.append({"id": self.ids[index].hex(), "name": self.names[index]})
+            index += 1
+        return results
+
+    async def load(self, db):
+        # Writes made while the snapshot is read are replayed on top of it
+        self._pending = []
+        try:
+            entries = []
+            async for product in db.products.find({}, {"name": 1}).batch_size(10000):
+                name = product.get("name")
+                if name:
+                    key = normalize(name)
+                    entries.append((key, product["_id"].binary, key if key == name else name))
+            entries.sort()
+            keys = [entry[0] for entry in entries]
+            ids = [entry[1] for entry in entries]
+            names = [entry[2] for entry in entries]
+            del entries
+            pending = self._pending
+            self.keys, self.names, self.ids = keys, names, ids
+            for operation, product_id, name in pending:
+                operation(product_id, name)
+            self.loaded = True
+        finally:
+            self._pending = None
+
+    async def _refresh_loop(self, db):
+        while True:
+            try:
+                await self.load(db)
+            except Exception as e:
+                logger.warning("Autocomplete index rebuild failed: %s", e)
+            await asyncio.sleep(AUTOCOMPLETE_REFRESH_SECONDS)
+
+    def start(self, db):
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop(db))
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+product_names = PrefixIndex()
@@ -0,0 +1,65 @@
+from bson import ObjectId
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+
+load_dotenv()
+
+CATEGORY_CACHE_REFRESH_SECONDS = float(os.getenv("CATEGORY_CACHE_REFRESH_SECONDS", "300"))
+
+logger = logging.getLogger(__name__)
+
+class CategoryCache:
+    """
+    In-memory set of known category IDs used to validate product writes
+    without a Mongo round trip. Misses fall back to one batched lookup.
+    """
+
+    def __init__(self):
+        self.ids = set()
+        self.loaded = False
+        self._refresh_task = None
+
+    async def load(self, db):
+        ids = set()
+        async for category in db.categories.find({}, {"_id": 1}):
+            ids.add(category["_id"])
+        self.ids = ids
+        self.loaded = True
+
+    def add(self, category_id: ObjectId):
+        self.ids.add(category_id)
+
+    async def find_missing(self, db, category_ids):
+        """Return the subset of category_ids that do not exist"""
+        unknown = {category_id for category_id in category_ids if category_id not in self.ids}
+        if not unknown:
+            return set()
+        async for category in db.categories.find({"_id": {"$in": list(unknown)}}, {"_id": 1}):
+            self.ids.add(category["_id"])
+            unknown.discard(category["_id"])
+        return unknown
+
+    async def _refresh_loop(self, db):
+        while True:
+            try:
+                await self.load(db)
+            except Exception as e:
+                logger.warning("Category cache refresh failed: %s", e)
+            await asyncio.sleep(CATEGORY_CACHE_REFRESH_SECONDS)
+
+    def start(self, db):
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop(db))
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+category_cache = CategoryCache()
@@ -0,0 +1,245 @@
+from collections import OrderedDict
+from datetime import datetime
+from dotenv import load_dotenv
+from bson import ObjectId
+from pymongo.errors import ExecutionTimeout, OperationFailure
+from typing import Optional, Set
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import re
+
+load_dotenv()
+
+# Changes buffered per subscriber before it is dropped and has to resume
+CHANGE_FEED_QUEUE_SIZE = int(os.getenv("CHANGE_FEED_QUEUE_SIZE", "1000"))
+# Idle interval after which a keepalive is sent to subscribers
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+# Recent changes kept per worker for reconnecting clients to replay from;
+# larger than the subscriber queue so a dropped subscriber can still resume
+CHANGE_FEED_REPLAY_SIZE = int(os.getenv("CHANGE_FEED_REPLAY_SIZE", "5000"))
+
+PIPELINE = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+# Resume tokens are hex encoded, their _data field is what SSE clients send back
+RESUME_TOKEN = re.compile(r"(?:[0-9A-Fa-f]{2})+")
+
+logger = logging.getLogger(__name__)
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+class Subscription:
+    def __init__(self, category_ids: Optional[Set[ObjectId]] = None, fields: Optional[Set[str]] = None, max_queue: int = CHANGE_FEED_QUEUE_SIZE):
+        self.category_ids = category_ids or None
+        self.fields = fields or None
+        self.queue = asyncio.Queue(maxsize=max_queue)
+
+    def matches(self, change) -> bool:
+        document = change.get("fullDocument")
+        # Deletes and updates of since-deleted documents carry no category
+        if self.category_ids and document is not None and document.get("category_id") not in self.category_ids:
+            return False
+        if self.fields and change["operationType"] == "update":
+            description = change["updateDescription"]
+            changed = {key.split(".")[0] for key in description.get("updatedFields", {})}
+            changed.update(key.split(".")[0] for key in description.get("removedFields", []))
+            if not changed & self.fields:
+                return False
+        return True
+
+    def offer(self, change) -> bool:
+        """Queue a change, returns False when the subscriber has fallen too far behind"""
+        if not self.matches(change):
+            return True
+        try:
+            self.queue.put_nowait(change)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def _project(self, values: dict) -> dict:
+        if self.fields is None:
+            return values
+        return {key: value for key, value in values.items() if key.split(".")[0] in self.fields}
+
+    def to_sse(self, change) -> str:
+        operation = change["operationType"]
+        event = {"operation": operation, "id": str(change["documentKey"]["_id"])}
+        document = change.get("fullDocument")
+        if document is not None:
+            event["category_id"] = str(document["category_id"]) if "category_id" in document else None
+            product = {key: value for key, value in document.items() if key != "_id"}
+            event["product"] = self._project(product)
+        if operation == "update":
+            description = change["updateDescription"]
+            event["updated_fields"] = self._project(description.get("updatedFields", {}))
+            event["removed_fields"] = [
+                key for key in description.get("removedFields", [])
+                if self.fields is None or key.split(".")[0] in self.fields
+            ]
+        data = json.dumps(event, default=_json_default)
+        return f"id: {change['_id']['_data']}\nevent: {operation}\ndata: {data}\n\n"
+
+class InvalidResumeToken(ValueError):
+    pass
+
+class ChangeFeed:
+    """
+    Fans a single products change stream out to every subscriber in this worker
+
+    The stream is opened when the first subscriber arrives and closed when the
+    last one leaves. The most recent changes are kept in a replay buffer keyed
+    by resume token, so a reconnecting client whose token is still buffered is
+    replayed from it and joins the shared stream straight away. Only an older
+    token gets a private stream, and only until it reaches a change the shared
+    stream has buffered.
+    """
+
+    def __init__(self, replay_size: int = CHANGE_FEED_REPLAY_SIZE):
+        self.replay_size = replay_size
+        self._subscribers = set()
+        self._catching_up = 0
+        self._recent = OrderedDict()
+        self._task = None
+
+    async def _run(self, db):
+        resume_token = None
+        while True:
+            try:
+                async with db.products.watch(PIPELINE, full_document="updateLookup", resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = change["_id"]
+                        self._recent[resume_token["_data"]] = change
+                        if len(self._recent) > self.replay_size:
+                            self._recent.popitem(last=False)
+                        for subscription in list(self._subscribers):
+                            if not subscription.offer(change):
+                                # Wake the subscriber so it ends its stream and resumes later
+                                self._subscribers.discard(subscription)
+                                subscription.queue.get_nowait()
+                                subscription.queue.put_nowait(None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Product change stream failed, reopening: %s", e)
+                await asyncio.sleep(1)
+
+    def _start(self, db):
+        if self._task is None:
+            # Fresh context so the shared stream does not inherit this
+            # request's trace or Mongo deadline
+            self._task = asyncio.create_task(self._run(db), context=contextvars.Context())
+
+    def _stop_if_idle(self):
+        if not self._subscribers and not self._catching_up and self._task is not None:
+            self._task.cancel()
+            self._task = None
+            # The next stream starts from scratch, older changes would leave a gap
+            self._recent.clear()
+
+    def _join(self, subscription: Subscription, resume_after: Optional[str] = None) -> list:
+        """Add a subscriber to the shared stream, returns the buffered changes after resume_after"""
+        self._subscribers.add(subscription)
+        if resume_after is None:
+            return []
+        tokens = list(self._recent)
+        return list(self._recent.values())[tokens.index(resume_after) + 1:]
+
+    async def subscribe(self, db, subscription: Subscription, resume_after: Optional[str] = None):
+        """
+        Start a subscription and return an async iterator over its SSE
+        messages, which yields None when idle for a heartbeat interval
+
+        Raises InvalidResumeToken before anything has been streamed when
+        MongoDB cannot resume from resume_after.
+        """
+        if not resume_after:
+            self._start(db)
+            return self._changes(subscription, self._join(subscription))
+        if resume_after in self._recent:
+            return self._changes(subscription, self._join(subscription, resume_after))
+        if not RESUME_TOKEN.fullmatch(resume_after):
+            raise InvalidResumeToken("Malformed resume token")
+
+        stream = db.products.watch(
+            PIPELINE,
+            full_document="updateLookup",
+            resume_after={"_data": resume_after},
+            max_await_time_ms=int(CHANGE_FEED_HEARTBEAT_SECONDS * 1000)
+        )
+        try:
+            # Opening the stream is when MongoDB checks the token
+            await stream.__aenter__()
+        except ExecutionTimeout:
+            raise
+        except OperationFailure as e:
+            raise InvalidResumeToken(f"Cannot resume from this token: {(e.details or {}).get('errmsg', e)}")
+        self._start(db)
+        return self._catch_up(stream, subscription)
+
+    async def _catch_up(self, stream, subscription: Subscription):
+        self._catching_up += 1
+        try:
+            replay = None
+            try:
+                while stream.alive:
+                    change = await stream.try_next()
+                    if change is None:
+                        yield None
+                        continue
+                    if subscription.matches(change):
+                        yield subscription.to_sse(change)
+                    token = change["_id"]["_data"]
+                    if token in self._recent:
+                        # Caught up with the shared stream, no await between
+                        # the check and joining so nothing is missed
+                        replay = self._join(subscription, token)
+                        break
+            finally:
+                await stream.close()
+            if replay is not None:
+                async for message in self._changes(subscription, replay):
+                    yield message
+        finally:
+            self._catching_up -= 1
+            self._subscribers.discard(subscription)
+            self._stop_if_idle()
+
+    async def _changes(self, subscription: Subscription, replay: list):
+        try:
+            for change in replay:
+                if subscription.matches(change):
+                    yield subscription.to_sse(change)
+            while True:
+                try:
+                    change = await asyncio.wait_for(subscription.queue.get(), CHANGE_FEED_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if change is None:
+                    return
+                yield subscription.to_sse(change)
+        finally:
+            self._subscribers.discard(subscription)
+            self._stop_if_idle()
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    async def stop(self):
+        self._subscribers.clear()
+        self._recent.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+change_feed = ChangeFeed()
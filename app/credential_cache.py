@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+import hashlib
+import hmac
+import os
+import secrets
+import time
+
+load_dotenv()
+
+# How long a successful password check is remembered (0 disables the cache)
+CREDENTIAL_CACHE_SECONDS = float(os.getenv("CREDENTIAL_CACHE_SECONDS", "300"))
+CREDENTIAL_CACHE_SIZE = int(os.getenv("CREDENTIAL_CACHE_SIZE", "10000"))
+
+class CredentialCache:
+    """
+    Remembers recently verified (user, password) pairs so repeated logins
+    skip bcrypt
+
+    Passwords are keyed by an HMAC under a per-process random key, so the
+    cache holds nothing that could be checked against a password offline.
+    Each entry records the stored bcrypt hash it was verified against; a
+    lookup only hits while the user's current hash is the same, so a
+    password changed anywhere, including directly in MongoDB as
+    update_password.py does, invalidates it on the next login.
+    """
+
+    def __init__(self, ttl: float = CREDENTIAL_CACHE_SECONDS, max_size: int = CREDENTIAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._key = secrets.token_bytes(32)
+        self._entries = OrderedDict()
+
+    def _cache_key(self, email: str, password: str):
+        digest = hmac.new(self._key, password.encode(), hashlib.sha256).digest()
+        return (email, digest)
+
+    def verified(self, email: str, password: str, hashed_password: str) -> bool:
+        if self.ttl <= 0:
+            return False
+        key = self._cache_key(email, password)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic() or entry[0] != hashed_password:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True
+
+    def add(self, email: str, password: str, hashed_password: str):
+        if self.ttl <= 0:
+            return
+        key = self._cache_key(email, password)
+        self._entries[key] = (hashed_password, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+credential_cache = CredentialCache()
@@ -1,5 +1,6 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
+from .tracing import mongo_command_tracer, span
 import os
 
 load_dotenv()
@@ -15,7 +16,7 @@ db = Database()
 
 async def get_database():
     if db.client is None:
-        db.client = AsyncIOMotorClient(MONGODB_URL)
+        db.client = AsyncIOMotorClient(MONGODB_URL, event_listeners=[mongo_command_tracer])
         db.db = db.client[MONGODB_DB]
     return db.db
 
@@ -25,7 +26,8 @@ async def close_database():
         db.client = None
 
 async def get_db():
-    database = await get_database()
+    with span("get_db"):
+        database = await get_database()
     try:
         yield database
     finally:
@@ -0,0 +1,145 @@
+from dotenv import load_dotenv
+from pymongo.errors import PyMongoError
+from typing import Optional
+import asyncio
+import json
+import os
+import pymongo
+
+from . import route_classes
+
+load_dotenv()
+
+# Default deadline per route class, in seconds. Clients can ask for a shorter
+# one with the X-Request-Timeout header (seconds) but never a longer one.
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "10"))
+AUTH_TIMEOUT_SECONDS = float(os.getenv("AUTH_TIMEOUT_SECONDS", str(REQUEST_TIMEOUT_SECONDS)))
+EXPORT_TIMEOUT_SECONDS = float(os.getenv("EXPORT_TIMEOUT_SECONDS", "600"))
+
+ROUTE_TIMEOUTS = {
+    route_classes.AUTH: AUTH_TIMEOUT_SECONDS,
+    route_classes.READ: REQUEST_TIMEOUT_SECONDS,
+    route_classes.WRITE: REQUEST_TIMEOUT_SECONDS,
+    route_classes.EXPORT: EXPORT_TIMEOUT_SECONDS,
+    # Long-lived streams are ended by the client, not by a deadline
+    route_classes.STREAM: None
+}
+
+TIMEOUT_HEADER = b"x-request-timeout"
+
+class DeadlineStats:
+    def __init__(self):
+        self.timed_out = 0
+        self.cancelled = 0
+
+    def as_dict(self):
+        return {"timed_out": self.timed_out, "cancelled": self.cancelled}
+
+deadline_stats = DeadlineStats()
+
+def request_timeout(scope) -> Optional[float]:
+    default = ROUTE_TIMEOUTS[route_classes.route_class(scope["method"], scope["path"])]
+    for name, value in scope.get("headers", []):
+        if name == TIMEOUT_HEADER:
+            try:
+                requested = float(value)
+            except ValueError:
+                break
+            if requested > 0:
+                return requested if default is None else min(requested, default)
+    return default
+
+def _has_body(scope) -> bool:
+    for name, value in scope.get("headers", []):
+        if name == b"transfer-encoding" or (name == b"content-length" and value != b"0"):
+            return True
+    return False
+
+class DeadlineMiddleware:
+    """
+    Runs each request under a pymongo.timeout() deadline, so every Motor
+    operation it issues carries the remaining time as maxTimeMS, and cancels
+    the handler as soon as the client disconnects
+
+    Disconnects are only watched for requests without a body, which covers
+    the reads and exports this is meant for, so the request body is never
+    read out from under the handler.
+    """
+
+    def __init__(self, app, stats: DeadlineStats = deadline_stats):
+        self.app = app
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+        response_complete = False
+
+        async def tracking_send(message):
+            nonlocal response_started, response_complete
+            if message["type"] == "http.response.start":
+                response_started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        async def respond_timeout():
+            body = json.dumps({"detail": "Request deadline exceeded"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 504,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+            })
+            await send({"type": "http.response.body", "body": body})
+
+        watch = not _has_body(scope)
+        app_receive = receive
+        if watch:
+            first_message = asyncio.get_running_loop().create_future()
+            disconnected = asyncio.Event()
+            first_delivered = False
+
+            async def app_receive():
+                nonlocal first_delivered
+                if not first_delivered:
+                    first_delivered = True
+                    return await first_message
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+
+            async def watch_disconnect():
+                message = await receive()
+                first_message.set_result(message)
+                while message["type"] != "http.disconnect":
+                    message = await receive()
+                disconnected.set()
+                if not response_complete and not handler.done():
+                    self.stats.cancelled += 1
+                    handler.cancel()
+
+        with pymongo.timeout(request_timeout(scope)):
+            # Created inside the timeout block so the handler inherits the deadline
+            handler = asyncio.ensure_future(self.app(scope, app_receive, tracking_send))
+        watcher = asyncio.ensure_future(watch_disconnect()) if watch else None
+
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if watcher is None or not disconnected.is_set():
+                raise
+            # The client went away, there is nobody left to respond to
+        except PyMongoError as e:
+            if not e.timeout:
+                raise
+            self.stats.timed_out += 1
+            if response_started:
+                raise
+            await respond_timeout()
+        finally:
+            if not handler.done():
+                handler.cancel()
+            if watcher is not None:
+                watcher.cancel()
@@ -0,0 +1,24 @@
+from pymongo import ASCENDING
+
+# Fields the product listing can be sorted on. Each gets a (field, _id) index
+# for unfiltered pages and a (category_id, field, _id) index for category
+# pages, so sorted results are always read in index order.
+PRODUCT_SORT_FIELDS = ("price", "name", "updated_at", "quantity")
+
+def product_indexes():
+    indexes = []
+    for field in PRODUCT_SORT_FIELDS:
+        indexes.append([(field, ASCENDING), ("_id", ASCENDING)])
+        indexes.append([("category_id", ASCENDING), (field, ASCENDING), ("_id", ASCENDING)])
+    return indexes
+
+async def ensure_indexes(db):
+    await db.categories.create_index("name", unique=True)
+    await db.users.create_index("email", unique=True)
+    for keys in product_indexes():
+        await db.products.create_index(keys)
+
+    # include_archived listings run the same filter and sort against the
+    # archive, so it gets the same indexes
+    for keys in product_indexes():
+        await db.products_archive.create_index(keys)
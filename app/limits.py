@@ -0,0 +1,60 @@
+from dotenv import load_dotenv
+import logging
+import os
+import time
+
+load_dotenv()
+
+# Largest page any list endpoint will return
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+# Estimated raw document bytes a single list response may materialize
+RESPONSE_BYTE_BUDGET = int(os.getenv("RESPONSE_BYTE_BUDGET", str(8 * 1024 * 1024)))
+# Target bytes per cursor batch, used to derive batch_size from document size
+CURSOR_BATCH_BYTES = int(os.getenv("CURSOR_BATCH_BYTES", str(1024 * 1024)))
+# Documents per raw batch read by the streaming exports
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Concurrent _id-range cursors per export (1 reads through a single cursor),
+# and the most a client may ask for with ?parallel=
+EXPORT_PARALLELISM = int(os.getenv("EXPORT_PARALLELISM", "1"))
+EXPORT_MAX_PARALLELISM = int(os.getenv("EXPORT_MAX_PARALLELISM", "8"))
+# Approximate products per _id range of a parallel export; up to
+# parallelism ranges are buffered at once, so this bounds its memory
+EXPORT_PARTITION_ROWS = int(os.getenv("EXPORT_PARTITION_ROWS", "20000"))
+DOCUMENT_SIZE_REFRESH_SECONDS = float(os.getenv("DOCUMENT_SIZE_REFRESH_SECONDS", "60"))
+DEFAULT_DOCUMENT_SIZE = 1024
+
+MIN_BATCH_SIZE = 16
+MAX_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+class DocumentSizeEstimator:
+    """Caches each collection's average document size from $collStats"""
+
+    def __init__(self, refresh_seconds: float = DOCUMENT_SIZE_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._sizes = {}
+
+    async def average(self, collection) -> int:
+        cached = self._sizes.get(collection.name)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        size = DEFAULT_DOCUMENT_SIZE
+        try:
+            stats = await collection.aggregate([{"$collStats": {"storageStats": {}}}]).to_list(1)
+            if stats:
+                size = int(stats[0]["storageStats"].get("avgObjSize") or DEFAULT_DOCUMENT_SIZE)
+        except Exception as e:
+            logger.warning("Could not read stats for %s: %s", collection.name, e)
+        self._sizes[collection.name] = (size, time.monotonic() + self.refresh_seconds)
+        return size
+
+document_sizes = DocumentSizeEstimator()
+
+def max_limit_for(average_size: int) -> int:
+    """Largest page that fits in the response byte budget"""
+    return max(1, min(MAX_PAGE_SIZE, RESPONSE_BYTE_BUDGET // max(average_size, 1)))
+
+def batch_size_for(average_size: int, limit: int) -> int:
+    batch_size = CURSOR_BATCH_BYTES // max(average_size, 1)
+    return max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, batch_size, limit))
@@ -1,15 +1,32 @@
-from fastapi import FastAPI, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, status
+from fastapi.security import OAuth2PasswordRequestForm
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import List
+import asyncio
 import json
-import csv
-from io import StringIO
-from fastapi.responses import StreamingResponse
+import logging
+import re
+from fastapi.responses import Response, StreamingResponse
+from pydantic import TypeAdapter
 from datetime import timedelta, datetime
 from bson import ObjectId
-from . import models, schemas, auth
-from .database import get_db
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from . import models, schemas, auth, raw_export
+from .database import get_db, get_database, close_database
+from .admission import AdmissionMiddleware, pools
+from .analytics import product_snapshot
+from .archive import ARCHIVE_COLLECTION, archiver
+from .autocomplete import product_names
+from .category_cache import category_cache
+from .credential_cache import credential_cache
+from .deadlines import DeadlineMiddleware, deadline_stats
+from .change_feed import InvalidResumeToken, Subscription, change_feed
+from .indexes import ensure_indexes, PRODUCT_SORT_FIELDS
+from .limits import EXPORT_BATCH_SIZE, EXPORT_MAX_PARALLELISM, EXPORT_PARALLELISM, MAX_PAGE_SIZE, batch_size_for, document_sizes, max_limit_for
+from .profiler import PROFILE_MAX_SECONDS, collapsed, loop_monitor, profiler
+from .query_cache import query_cache
+from .tracing import TracedOAuth2PasswordBearer, TracingMiddleware, span, span_exporter
 
 app = FastAPI(
     title="Product Management System API",
@@ -31,11 +48,174 @@ app = FastAPI(
         {
             "name": "export",
             "description": "Data export operations"
+        },
+        {
+            "name": "metrics",
+            "description": "Runtime metrics"
+        },
+        {
+            "name": "analytics",
+            "description": "Catalog statistics served from an in-memory snapshot"
+        },
+        {
+            "name": "debug",
+            "description": "Live profiling of the worker"
         }
     ]
 )
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+app.add_middleware(TracingMiddleware)
+app.add_middleware(DeadlineMiddleware)
+app.add_middleware(AdmissionMiddleware)
+
+oauth2_scheme = TracedOAuth2PasswordBearer(tokenUrl="token")
+
+logger = logging.getLogger(__name__)
+
+@app.on_event("startup")
+async def startup():
+    database = await get_database()
+    try:
+        await ensure_indexes(database)
+    except Exception as e:
+        logger.warning("Could not ensure indexes: %s", e)
+    category_cache.start(database)
+    product_names.start(database)
+    archiver.start(database)
+    product_snapshot.start(database)
+    span_exporter.start()
+    loop_monitor.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await category_cache.stop()
+    await product_names.stop()
+    await archiver.stop()
+    await product_snapshot.stop()
+    await query_cache.close()
+    await change_feed.stop()
+    await span_exporter.stop()
+    await loop_monitor.stop()
+    await close_database()
+
+def build_product_query(
+    category_id: str = None,
+    name: str = None,
+    min_price: float = None,
+    max_price: float = None,
+    min_quantity: int = None,
+    in_stock: bool = None,
+    updated_after: datetime = None
+):
+    query = {}
+    if category_id:
+        try:
+            query["category_id"] = ObjectId(category_id)
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid category ID")
+    if name:
+        query["name"] = {"$regex": name, "$options": "i"}
+    if min_price is not None:
+        query.setdefault("price", {})["$gte"] = min_price
+    if max_price is not None:
+        query.setdefault("price", {})["$lte"] = max_price
+    if min_quantity is not None:
+        query.setdefault("quantity", {})["$gte"] = min_quantity
+    if in_stock is True:
+        quantity = query.setdefault("quantity", {})
+        quantity["$gte"] = max(quantity.get("$gte", 1), 1)
+    elif in_stock is False:
+        query.setdefault("quantity", {})["$lte"] = 0
+    if updated_after is not None:
+        query["updated_at"] = {"$gt": updated_after}
+    return query
+
+def build_product_sort(sort: str, query: dict):
+    """
+    Turn a sort parameter such as "price" or "-updated_at" into a sort spec
+
+    Every sort is served by a (field, _id) or (category_id, field, _id) index.
+    Without a category_id, a range filter on a different field than the sort
+    field would have to walk the whole sort index, so it is rejected.
+    """
+    if not sort:
+        return None
+    field = sort.lstrip("-")
+    direction = DESCENDING if sort.startswith("-") else ASCENDING
+    if field not in PRODUCT_SORT_FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid sort field, expected one of: {', '.join(PRODUCT_SORT_FIELDS)}"
+        )
+    if "category_id" not in query:
+        for filter_field in ("name", "price", "quantity", "updated_at"):
+            if filter_field in query and filter_field != field:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Filtering on {filter_field} while sorting on {field} requires category_id"
+                )
+    return [(field, direction), ("_id", direction)]
+
+product_list_adapter = TypeAdapter(List[schemas.ProductResponse])
+
+async def invalidate_product_listings(*category_ids):
+    await query_cache.invalidate("all", *(f"category:{category_id}" for category_id in category_ids if category_id))
+
+async def check_page_budget(collection, limit: int):
+    """Reject pages whose estimated size exceeds the response budget, return the average document size"""
+    average_size = await document_sizes.average(collection)
+    max_limit = max_limit_for(average_size)
+    if limit > max_limit:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Requested page exceeds the response size budget, use limit <= {max_limit}"
+        )
+    return average_size
+
+async def read_page(collection, query: dict, skip: int, limit: int, sort_spec=None):
+    average_size = await check_page_budget(collection, limit)
+    cursor = collection.find(query)
+    if sort_spec:
+        cursor = cursor.sort(sort_spec)
+    cursor = cursor.skip(skip).limit(limit).batch_size(batch_size_for(average_size, limit))
+    return await cursor.to_list(limit)
+
+async def read_page_with_archive(db, query: dict, skip: int, limit: int, sort_spec=None):
+    """Like read_page, but over the hot products followed by the archived ones"""
+    average_size = await check_page_budget(db.products, limit)
+    pipeline = [{"$match": query}, {"$unionWith": {"coll": ARCHIVE_COLLECTION, "pipeline": [{"$match": query}]}}]
+    if sort_spec:
+        pipeline.append({"$sort": dict(sort_spec)})
+    pipeline += [{"$skip": skip}, {"$limit": limit}]
+    cursor = db.products.aggregate(pipeline, batchSize=batch_size_for(average_size, limit))
+    return await cursor.to_list(limit)
+
+async def raise_product_not_found(db, product_id: ObjectId):
+    """404 for a product that does not exist, 409 for one that is archived"""
+    if await db[ARCHIVE_COLLECTION].count_documents({"_id": product_id}, limit=1):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Product is archived, restore it with POST /products/{product_id}/restore before changing it"
+        )
+    raise HTTPException(status_code=404, detail="Product not found")
+
+async def validate_category_ids(db, category_ids):
+    missing = await category_cache.find_missing(db, category_ids)
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Category not found: {', '.join(sorted(str(category_id) for category_id in missing))}"
+        )
+
+def verified_token(token: str = Depends(oauth2_scheme)):
+    """Require a valid, unexpired access token, not just a bearer header"""
+    if auth.decode_access_token(token) is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return token
 
 # Authentication endpoints
 @app.post("/token", response_model=schemas.Token, tags=["authentication"])
@@ -50,17 +230,57 @@ async def login_for_access_token(
     - **password**: User's password
     """
     user = await db.users.find_one({"email": form_data.username})
-    if not user or not auth.verify_password(form_data.password, user["hashed_password"]):
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    hashed_password = user["hashed_password"]
+    if not credential_cache.verified(user["email"], form_data.password, hashed_password):
+        # bcrypt is deliberately slow, keep it off the event loop
+        if not await asyncio.to_thread(auth.verify_password, form_data.password, hashed_password):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect username or password",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        credential_cache.add(user["email"], form_data.password, hashed_password)
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"sub": user["email"]}, expires_delta=access_token_expires
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    refresh_token = auth.create_refresh_token(user["email"], hashed_password)
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@app.post("/token/refresh", response_model=schemas.Token, tags=["authentication"])
+async def refresh_access_token(
+    request: schemas.RefreshRequest,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Exchange a refresh token for a new access token without a password check
+
+    Refresh tokens stop working once the user's password changes.
+    """
+    payload = auth.decode_refresh_token(request.refresh_token)
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user = await db.users.find_one({"email": payload["sub"]}, {"hashed_password": 1})
+    if not user or auth.password_fingerprint(user["hashed_password"]) != payload.get("pwv"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh token has been revoked",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token = auth.create_access_token(
+        data={"sub": payload["sub"]}, expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": request.refresh_token}
 
 # Category endpoints
 @app.post("/categories/", response_model=schemas.CategoryResponse)
@@ -71,17 +291,18 @@ async def create_category(
 ):
     category_dict = category.dict()
     result = await db.categories.insert_one(category_dict)
+    category_cache.add(result.inserted_id)
     created_category = await db.categories.find_one({"_id": result.inserted_id})
     return created_category
 
 @app.get("/categories/", response_model=List[schemas.CategoryResponse])
 async def read_categories(
-    skip: int = 0,
-    limit: int = 100,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
     db: AsyncIOMotorDatabase = Depends(get_db),
     token: str = Depends(oauth2_scheme)
 ):
-    categories = await db.categories.find().skip(skip).limit(limit).to_list(None)
+    categories = await read_page(db.categories, {}, skip, limit)
     return categories
 
 @app.get("/categories/{category_id}", response_model=schemas.CategoryResponse)
@@ -95,7 +316,7 @@ async def read_category(
         if category is None:
             raise HTTPException(status_code=404, detail="Category not found")
         return category
-    except:
+    except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid category ID")
 
 # Product endpoints
@@ -106,33 +327,175 @@ async def create_product(
     token: str = Depends(oauth2_scheme)
 ):
     product_dict = product.dict()
-    product_dict["category_id"] = ObjectId(product_dict["category_id"])
+    try:
+        product_dict["category_id"] = ObjectId(product_dict["category_id"])
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid category ID")
+    await validate_category_ids(db, [product_dict["category_id"]])
     product_dict["created_at"] = datetime.utcnow()
     product_dict["updated_at"] = datetime.utcnow()
     result = await db.products.insert_one(product_dict)
+    product_names.add(result.inserted_id, product_dict["name"])
+    await invalidate_product_listings(product_dict["category_id"])
     created_product = await db.products.find_one({"_id": result.inserted_id})
     return created_product
 
 @app.get("/products/", response_model=List[schemas.ProductResponse])
 async def read_products(
-    skip: int = 0,
-    limit: int = 100,
-    category_id: str = None,
-    name: str = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    sort: str = None,
+    include_archived: bool = False,
+    query: dict = Depends(build_product_query),
     db: AsyncIOMotorDatabase = Depends(get_db),
     token: str = Depends(oauth2_scheme)
 ):
-    query = {}
-    if category_id:
-        try:
-            query["category_id"] = ObjectId(category_id)
-        except:
-            raise HTTPException(status_code=400, detail="Invalid category ID")
-    if name:
-        query["name"] = {"$regex": name, "$options": "i"}
-    
-    products = await db.products.find(query).skip(skip).limit(limit).to_list(None)
-    return products
+    """
+    List products
+
+    - **sort**: one of price, name, updated_at, quantity; prefix with "-" for descending
+    - **min_price** / **max_price**, **min_quantity**, **in_stock**, **updated_after**: range filters
+    - **include_archived**: also list products moved to the archive
+    """
+    sort_spec = build_product_sort(sort, query)
+
+    async def load_page():
+        if include_archived:
+            products = await read_page_with_archive(db, query, skip, limit, sort_spec)
+        else:
+            products = await read_page(db.products, query, skip, limit, sort_spec)
+        with span("validate"):
+            products = product_list_adapter.validate_python(products)
+        with span("serialize"):
+            return product_list_adapter.dump_json(products, by_alias=True)
+
+    tag = f"category:{query['category_id']}" if "category_id" in query else "all"
+    content = await query_cache.get_or_compute(
+        "products:list",
+        tag,
+        {"skip": skip, "limit": limit, "sort": sort, "query": query, "include_archived": include_archived},
+        load_page
+    )
+    return Response(content=content, media_type="application/json")
+
+@app.get("/products/facets", response_model=schemas.ProductFacets)
+async def read_product_facets(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    sort: str = None,
+    query: dict = Depends(build_product_query),
+    price_buckets: int = Query(5, ge=1, le=50),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Return a page of products together with category counts, price buckets
+    and stock counts, computed in a single $facet aggregation
+
+    Accepts the same filters and sort as the product listing. The filter runs
+    as the leading $match so it can use the category_id and name indexes.
+    Without a sort the page is in _id order, so skip/limit pages are stable.
+    """
+    sort_spec = build_product_sort(sort, query) or [("_id", ASCENDING)]
+    await check_page_budget(db.products, limit)
+    pipeline = [
+        {"$match": query},
+        {"$facet": {
+            "results": [{"$sort": dict(sort_spec)}, {"$skip": skip}, {"$limit": limit}],
+            "total": [{"$count": "count"}],
+            "categories": [
+                {"$group": {"_id": "$category_id", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}}
+            ],
+            "price_buckets": [
+                {"$bucketAuto": {"groupBy": "$price", "buckets": price_buckets}}
+            ],
+            "stock": [
+                {"$group": {"_id": {"$gt": ["$quantity", 0]}, "count": {"$sum": 1}}}
+            ]
+        }}
+    ]
+    facets = (await db.products.aggregate(pipeline).to_list(1))[0]
+
+    stock = {"in_stock": 0, "out_of_stock": 0}
+    for group in facets["stock"]:
+        stock["in_stock" if group["_id"] else "out_of_stock"] = group["count"]
+
+    return {
+        "total": facets["total"][0]["count"] if facets["total"] else 0,
+        "results": facets["results"],
+        "categories": [
+            {"category_id": group["_id"], "count": group["count"]}
+            for group in facets["categories"]
+        ],
+        "price_buckets": [
+            {"min": bucket["_id"]["min"], "max": bucket["_id"]["max"], "count": bucket["count"]}
+            for bucket in facets["price_buckets"]
+        ],
+        "stock": stock
+    }
+
+@app.get("/products/autocomplete", response_model=List[schemas.ProductSuggestion])
+async def autocomplete_products(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Suggest products whose name starts with **q** (case-insensitive)
+
+    Served from the in-memory name index; until it has been built after
+    startup, falls back to an anchored regex query.
+    """
+    if product_names.loaded:
+        return product_names.search(q, limit)
+    cursor = db.products.find(
+        {"name": {"$regex": "^" + re.escape(q), "$options": "i"}},
+        {"name": 1}
+    ).limit(limit)
+    return [{"id": str(product["_id"]), "name": product["name"]} async for product in cursor]
+
+@app.get("/products/changes")
+async def product_changes(
+    category_id: List[str] = Query(None),
+    fields: List[str] = Query(None),
+    resume_after: str = None,
+    last_event_id: str = Header(None),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Stream product inserts, updates and deletes as Server-Sent Events
+
+    - **category_id**: only changes to products in these categories (repeatable)
+    - **fields**: only updates touching these fields, and only these fields in the payload (repeatable)
+    - **resume_after**: resume token (the SSE event id) to continue after; the
+      Last-Event-ID header sent by reconnecting EventSource clients works too
+
+    Requires MongoDB running as a replica set.
+    """
+    try:
+        category_ids = {ObjectId(value) for value in category_id or []}
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid category ID")
+    subscription = Subscription(category_ids, set(fields or []))
+    try:
+        # Checked before the response starts, so a bad token is a 400
+        # rather than a stream that ends right after its headers
+        messages = await change_feed.subscribe(db, subscription, resume_after or last_event_id)
+    except InvalidResumeToken as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def event_stream():
+        async for message in messages:
+            yield message if message is not None else ": keepalive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/products/{product_id}", response_model=schemas.ProductResponse)
 async def read_product(
@@ -142,10 +505,40 @@ async def read_product(
 ):
     try:
         product = await db.products.find_one({"_id": ObjectId(product_id)})
+        if product is None:
+            product = await db[ARCHIVE_COLLECTION].find_one({"_id": ObjectId(product_id)})
         if product is None:
             raise HTTPException(status_code=404, detail="Product not found")
         return product
-    except:
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid product ID")
+
+@app.post("/products/archive")
+async def archive_products(
+    max_batches: int = Query(1, ge=1, le=100),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Run an archival pass now, moving cold products to the archive
+
+    - **max_batches**: upper bound on the number of batches moved by this call
+    """
+    archived = await archiver.run_detached(db, max_batches)
+    return {"archived": archived}
+
+@app.post("/products/{product_id}/restore", response_model=schemas.ProductResponse)
+async def restore_product(
+    product_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    token: str = Depends(oauth2_scheme)
+):
+    try:
+        product = await archiver.restore(db, ObjectId(product_id))
+        if product is None:
+            raise HTTPException(status_code=404, detail="Archived product not found")
+        return product
+    except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid product ID")
 
 @app.put("/products/{product_id}", response_model=schemas.ProductResponse)
@@ -155,24 +548,221 @@ async def update_product(
     db: AsyncIOMotorDatabase = Depends(get_db),
     token: str = Depends(oauth2_scheme)
 ):
+    product_dict = product.dict()
     try:
-        product_dict = product.dict()
         product_dict["category_id"] = ObjectId(product_dict["category_id"])
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid category ID")
+    await validate_category_ids(db, [product_dict["category_id"]])
+    try:
         product_dict["updated_at"] = datetime.utcnow()
         
-        result = await db.products.update_one(
+        previous_product = await db.products.find_one_and_update(
             {"_id": ObjectId(product_id)},
             {"$set": product_dict}
         )
         
-        if result.modified_count == 0:
-            raise HTTPException(status_code=404, detail="Product not found")
-            
-        updated_product = await db.products.find_one({"_id": ObjectId(product_id)})
-        return updated_product
-    except:
+        if previous_product is None:
+            await raise_product_not_found(db, ObjectId(product_id))
+
+        product_names.rename(previous_product["_id"], previous_product["name"], product_dict["name"])
+        await invalidate_product_listings(previous_product["category_id"], product_dict["category_id"])
+        return {**previous_product, **product_dict}
+    except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid product ID")
 
+@app.patch("/products/{product_id}", response_model=schemas.ProductResponse)
+async def patch_product(
+    product_id: str,
+    product: schemas.ProductUpdate,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Partially update a product, only the fields present in the body are written
+    """
+    try:
+        product_oid = ObjectId(product_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid product ID")
+    product_dict = product.dict(exclude_unset=True)
+    if "category_id" in product_dict:
+        try:
+            product_dict["category_id"] = ObjectId(product_dict["category_id"])
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid category ID")
+        await validate_category_ids(db, [product_dict["category_id"]])
+    product_dict["updated_at"] = datetime.utcnow()
+
+    previous_product = await db.products.find_one_and_update(
+        {"_id": product_oid},
+        {"$set": product_dict}
+    )
+    if previous_product is None:
+        await raise_product_not_found(db, product_oid)
+    if product_dict.get("name"):
+        product_names.rename(product_oid, previous_product["name"], product_dict["name"])
+    await invalidate_product_listings(previous_product["category_id"], product_dict.get("category_id"))
+    return {**previous_product, **product_dict}
+
+@app.post("/products/stock", response_model=schemas.BulkStockAdjustmentResult)
+async def adjust_stock_bulk(
+    adjustment: schemas.BulkStockAdjustment,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Apply many stock adjustments in a single bulk write
+
+    Adjustments that would take a product below zero are skipped unless
+    **allow_negative** is set, and are not counted as matched.
+    """
+    now = datetime.utcnow()
+    operations = []
+    for item in adjustment.items:
+        try:
+            query = {"_id": ObjectId(item.product_id)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail=f"Invalid product ID: {item.product_id}")
+        if not adjustment.allow_negative and item.delta < 0:
+            query["quantity"] = {"$gte": -item.delta}
+        operations.append(UpdateOne(
+            query,
+            {"$inc": {"quantity": item.delta}, "$set": {"updated_at": now}}
+        ))
+
+    if not operations:
+        return {"requested": 0, "matched_count": 0, "modified_count": 0}
+
+    result = await db.products.bulk_write(operations, ordered=False)
+    if result.modified_count:
+        await query_cache.invalidate_all()
+    return {
+        "requested": len(operations),
+        "matched_count": result.matched_count,
+        "modified_count": result.modified_count
+    }
+
+def filter_query(product_filter: schemas.ProductFilter):
+    return build_product_query(**product_filter.dict())
+
+@app.post("/products/bulk-update", response_model=schemas.BulkWriteResult)
+async def bulk_update_products(
+    update: schemas.BulkProductUpdate,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Update every product matching a filter in a single update_many
+
+    - **filter**: same fields as the GET /products/ query parameters
+    - **set**: literal values for description, price, quantity or category_id
+    - **multiply_price**: multiply prices by a factor, rounded to cents
+    - **increment_quantity**: add to quantities; products that would go below zero are skipped unless **allow_negative** is set
+    - **dry_run**: only count the matching products
+    """
+    query = filter_query(update.filter)
+    fields = update.set.dict(exclude_unset=True) if update.set else {}
+    if update.multiply_price is not None and "price" in fields:
+        raise HTTPException(status_code=400, detail="Cannot both set and multiply price")
+    if update.increment_quantity is not None and "quantity" in fields:
+        raise HTTPException(status_code=400, detail="Cannot both set and increment quantity")
+    if not fields and update.multiply_price is None and update.increment_quantity is None:
+        raise HTTPException(status_code=400, detail="No update operation given")
+    if "category_id" in fields:
+        try:
+            fields["category_id"] = ObjectId(fields["category_id"])
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid category ID")
+        await validate_category_ids(db, [fields["category_id"]])
+    if update.increment_quantity is not None and update.increment_quantity < 0 and not update.allow_negative:
+        quantity = query.setdefault("quantity", {})
+        quantity["$gte"] = max(quantity.get("$gte", -update.increment_quantity), -update.increment_quantity)
+
+    if update.dry_run:
+        matched = await db.products.count_documents(query)
+        return {"dry_run": True, "matched_count": matched, "modified_count": 0}
+
+    # $literal keeps string values such as "$price" from being read as field paths
+    stage = {field: {"$literal": value} for field, value in fields.items()}
+    if update.multiply_price is not None:
+        stage["price"] = {"$round": [{"$multiply": ["$price", update.multiply_price]}, 2]}
+    if update.increment_quantity is not None:
+        stage["quantity"] = {"$add": ["$quantity", update.increment_quantity]}
+    stage["updated_at"] = "$$NOW"
+
+    result = await db.products.update_many(query, [{"$set": stage}])
+    if result.modified_count:
+        await query_cache.invalidate_all()
+    return {"dry_run": False, "matched_count": result.matched_count, "modified_count": result.modified_count}
+
+@app.post("/products/bulk-delete", response_model=schemas.BulkWriteResult)
+async def bulk_delete_products(
+    delete: schemas.BulkProductDelete,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Delete every product matching a filter, archived ones included, with one
+    delete_many per collection
+
+    - **filter**: same fields as the GET /products/ query parameters, must not be empty
+    - **dry_run**: only count the matching products
+    """
+    query = filter_query(delete.filter)
+    if not query:
+        raise HTTPException(status_code=400, detail="Refusing to delete every product, give a filter")
+    # Archived products match too, as they do for delete_product
+    archive = db[ARCHIVE_COLLECTION]
+    if delete.dry_run:
+        matched = await db.products.count_documents(query) + await archive.count_documents(query)
+        return {"dry_run": True, "matched_count": matched, "modified_count": 0}
+
+    # Names are read first so the autocomplete index can drop them; products
+    # inserted in between are picked up by its next refresh. Archived ones
+    # are not in the index.
+    deleted = [product async for product in db.products.find(query, {"name": 1})]
+    result = await db.products.delete_many(query)
+    archived_result = await archive.delete_many(query)
+    for product in deleted:
+        product_names.remove(product["_id"], product["name"])
+    deleted_count = result.deleted_count + archived_result.deleted_count
+    if deleted_count:
+        await query_cache.invalidate_all()
+    return {"dry_run": False, "matched_count": deleted_count, "modified_count": deleted_count}
+
+@app.post("/products/{product_id}/stock", response_model=schemas.ProductResponse)
+async def adjust_stock(
+    product_id: str,
+    adjustment: schemas.StockAdjustment,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Atomically add **delta** (which may be negative) to a product's quantity
+
+    - **allow_negative**: permit the quantity to drop below zero
+    """
+    try:
+        query = {"_id": ObjectId(product_id)}
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid product ID")
+    if not adjustment.allow_negative and adjustment.delta < 0:
+        query["quantity"] = {"$gte": -adjustment.delta}
+
+    updated_product = await db.products.find_one_and_update(
+        query,
+        {"$inc": {"quantity": adjustment.delta}, "$set": {"updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated_product is None:
+        # Only pay for the extra lookup on the failure path
+        if await db.products.count_documents({"_id": query["_id"]}, limit=1) == 0:
+            await raise_product_not_found(db, query["_id"])
+        raise HTTPException(status_code=409, detail="Insufficient stock")
+    await invalidate_product_listings(updated_product["category_id"])
+    return updated_product
+
 @app.delete("/products/{product_id}")
 async def delete_product(
     product_id: str,
@@ -180,50 +770,187 @@ async def delete_product(
     token: str = Depends(oauth2_scheme)
 ):
     try:
-        result = await db.products.delete_one({"_id": ObjectId(product_id)})
-        if result.deleted_count == 0:
+        deleted_product = await db.products.find_one_and_delete(
+            {"_id": ObjectId(product_id)},
+            projection={"category_id": 1, "name": 1}
+        )
+        # Also drop any archive copy, so the archive fallback of read_product
+        # cannot bring a deleted product back
+        archived_product = await db[ARCHIVE_COLLECTION].find_one_and_delete(
+            {"_id": ObjectId(product_id)},
+            projection={"category_id": 1, "name": 1}
+        )
+        deleted_product = deleted_product or archived_product
+        if deleted_product is None:
             raise HTTPException(status_code=404, detail="Product not found")
+        product_names.remove(deleted_product["_id"], deleted_product["name"])
+        await invalidate_product_listings(deleted_product["category_id"])
         return {"message": "Product deleted successfully"}
-    except:
+    except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid product ID")
 
 # Export endpoints
 @app.get("/export/products/json")
 async def export_products_json(
+    parallel: int = Query(None, ge=1, le=EXPORT_MAX_PARALLELISM),
     db: AsyncIOMotorDatabase = Depends(get_db),
     token: str = Depends(oauth2_scheme)
 ):
-    products = await db.products.find().to_list(None)
-    products_list = []
-    for product in products:
-        product["id"] = str(product["_id"])
-        product["category_id"] = str(product["category_id"])
-        del product["_id"]
-        products_list.append(product)
-    return products_list
+    """
+    Export all products as a JSON array
+
+    - **parallel**: number of _id ranges read concurrently; above 1 the output is in _id order
+    """
+    partitions = parallel or EXPORT_PARALLELISM
+    if partitions > 1:
+        bounds = await raw_export.partition_bounds(db.products, partitions)
+        return StreamingResponse(raw_export.parallel_json_stream(db.products, bounds, partitions), media_type="application/json")
+    cursor = db.products.find_raw_batches({}, batch_size=EXPORT_BATCH_SIZE)
+    return StreamingResponse(raw_export.json_stream(cursor), media_type="application/json")
 
 @app.get("/export/products/csv")
 async def export_products_csv(
+    parallel: int = Query(None, ge=1, le=EXPORT_MAX_PARALLELISM),
     db: AsyncIOMotorDatabase = Depends(get_db),
     token: str = Depends(oauth2_scheme)
 ):
-    products = await db.products.find().to_list(None)
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["id", "name", "description", "price", "quantity", "category_id", "created_at", "updated_at"])
-    
-    for product in products:
-        writer.writerow([
-            str(product["_id"]),
-            product["name"],
-            product["description"],
-            product["price"],
-            product["quantity"],
-            str(product["category_id"]),
-            product["created_at"].isoformat() if "created_at" in product else "",
-            product["updated_at"].isoformat() if "updated_at" in product else ""
-        ])
-    
-    response = StreamingResponse(iter([output.getvalue()]), media_type="text/csv")
+    """
+    Export all products as CSV
+
+    - **parallel**: number of _id ranges read concurrently; above 1 the output is in _id order
+    """
+    partitions = parallel or EXPORT_PARALLELISM
+    if partitions > 1:
+        bounds = await raw_export.partition_bounds(db.products, partitions)
+        response = StreamingResponse(raw_export.parallel_csv_stream(db.products, bounds, partitions), media_type="text/csv")
+    else:
+        cursor = db.products.find_raw_batches({}, raw_export.CSV_PROJECTION, batch_size=EXPORT_BATCH_SIZE)
+        response = StreamingResponse(raw_export.csv_stream(cursor), media_type="text/csv")
     response.headers["Content-Disposition"] = "attachment; filename=products.csv"
     return response
+
+# Metrics endpoints
+@app.get("/metrics/cache", tags=["metrics"])
+async def query_cache_metrics(token: str = Depends(oauth2_scheme)):
+    return query_cache.stats()
+
+@app.get("/metrics/deadlines", tags=["metrics"])
+async def deadline_metrics(token: str = Depends(oauth2_scheme)):
+    return deadline_stats.as_dict()
+
+@app.get("/metrics/admission", tags=["metrics"])
+async def admission_metrics(token: str = Depends(oauth2_scheme)):
+    return {name: pool.stats() for name, pool in pools.items()}
+
+@app.get("/metrics/credentials", tags=["metrics"])
+async def credential_cache_metrics(token: str = Depends(oauth2_scheme)):
+    return credential_cache.stats()
+
+@app.get("/metrics/archive", tags=["metrics"])
+async def archive_metrics(token: str = Depends(oauth2_scheme)):
+    return archiver.stats()
+
+# Analytics endpoints
+def require_snapshot():
+    if not product_snapshot.ready:
+        raise HTTPException(status_code=503, detail="Analytics snapshot is not loaded yet")
+
+def analytics_category(category_id: str = None, ready: None = Depends(require_snapshot)):
+    if category_id is None:
+        return None
+    try:
+        return ObjectId(category_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid category ID")
+
+@app.get("/analytics/price/percentiles", response_model=schemas.PricePercentiles, tags=["analytics"])
+async def price_percentiles(
+    q: List[float] = Query([50, 90, 99]),
+    category_id = Depends(analytics_category),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Price percentiles across the catalog or one category
+
+    - **q**: percentiles to compute, repeatable (`?q=50&q=95`)
+    """
+    if any(percentile < 0 or percentile > 100 for percentile in q):
+        raise HTTPException(status_code=400, detail="Percentiles must be between 0 and 100")
+    return product_snapshot.price_percentiles(q, category_id)
+
+@app.get("/analytics/{field}/histogram", response_model=schemas.Histogram, tags=["analytics"])
+async def histogram(
+    field: str,
+    bins: int = Query(20, ge=1, le=1000),
+    min_value: float = None,
+    max_value: float = None,
+    category_id = Depends(analytics_category),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Histogram of price or quantity
+
+    - **field**: price or quantity
+    - **min_value** / **max_value**: histogram range, defaults to the data range
+    """
+    if field not in ("price", "quantity"):
+        raise HTTPException(status_code=404, detail="Histograms are available for price and quantity")
+    try:
+        return product_snapshot.histogram(field, bins, category_id, min_value, max_value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analytics/stock/by-category", response_model=List[schemas.CategoryStock], tags=["analytics"])
+async def stock_by_category(
+    ready: None = Depends(require_snapshot),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Stock distribution per category: product count, quantity totals and range, out-of-stock count and stock value
+    """
+    return product_snapshot.stock_by_category()
+
+@app.get("/analytics/price-quantity/correlation", response_model=schemas.PriceQuantityCorrelation, tags=["analytics"])
+async def price_quantity_correlation(
+    category_id = Depends(analytics_category),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Pearson and Spearman correlation between price and quantity
+    """
+    return product_snapshot.price_quantity_correlation(category_id)
+
+@app.get("/analytics/status", tags=["analytics"])
+async def analytics_status(token: str = Depends(oauth2_scheme)):
+    return product_snapshot.status()
+
+# Debug endpoints
+@app.get("/debug/profile", tags=["debug"])
+async def debug_profile(
+    seconds: float = Query(5, gt=0, le=PROFILE_MAX_SECONDS),
+    token: str = Depends(verified_token)
+):
+    """
+    Sample the event loop thread of this worker and return collapsed stacks
+
+    The output is one "frame;frame;... count" line per distinct stack, ready
+    for flamegraph.pl or speedscope.
+
+    - **seconds**: how long to sample for
+    """
+    try:
+        counts = await profiler.profile(seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(
+        content=collapsed(counts),
+        media_type="text/plain",
+        headers={"Content-Disposition": "attachment; filename=profile.folded"}
+    )
+
+@app.get("/debug/loop", tags=["debug"])
+async def debug_loop(token: str = Depends(verified_token)):
+    """
+    Event loop lag and the stacks of recent callbacks that blocked the loop
+    """
+    return loop_monitor.report()
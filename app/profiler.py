@@ -0,0 +1,195 @@
+"""
+Live diagnostics for the event loop thread
+
+SamplingProfiler reads the loop thread's current frame from another thread
+at a fixed interval and counts the stacks it sees, producing collapsed
+stacks ("frame;frame;frame count") that flamegraph.pl, speedscope and
+similar tools read directly. LoopMonitor measures how late a periodic
+heartbeat on the loop runs, and when the loop stays blocked past a
+threshold it captures the stack that is blocking it.
+"""
+
+from collections import Counter, deque
+from datetime import datetime
+from dotenv import load_dotenv
+import asyncio
+import os
+import sys
+import threading
+import time
+
+load_dotenv()
+
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "1") == "1"
+LOOP_MONITOR_INTERVAL_SECONDS = float(os.getenv("LOOP_MONITOR_INTERVAL_SECONDS", "0.1"))
+# A loop blocked this long is reported as a slow callback together with its stack
+LOOP_SLOW_CALLBACK_SECONDS = float(os.getenv("LOOP_SLOW_CALLBACK_SECONDS", "0.1"))
+LOOP_SLOW_CALLBACK_HISTORY = int(os.getenv("LOOP_SLOW_CALLBACK_HISTORY", "50"))
+
+def _short_path(filename: str) -> str:
+    for marker in ("site-packages/", "/app/"):
+        index = filename.rfind(marker)
+        if index != -1:
+            return filename[index + 1:] if marker == "/app/" else filename[index + len(marker):]
+    return filename
+
+def frame_stack(frame) -> list:
+    """Frame labels from the outermost call to the innermost"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def thread_stack(thread_id: int) -> list:
+    frame = sys._current_frames().get(thread_id)
+    return frame_stack(frame) if frame is not None else []
+
+class SamplingProfiler:
+    """Samples one thread's stack from a helper thread, one profile at a time"""
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    def _sample(self, thread_id: int, stop: threading.Event, counts: Counter):
+        while not stop.wait(self.interval):
+            stack = thread_stack(thread_id)
+            if stack:
+                counts[";".join(stack)] += 1
+
+    async def profile(self, seconds: float) -> Counter:
+        """Sample the calling (event loop) thread for the given time, returns stack counts"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        counts = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident(), stop, counts),
+            name="sampling-profiler",
+            daemon=True
+        )
+        try:
+            sampler.start()
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+            self._lock.release()
+        return counts
+
+def collapsed(counts: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+class LoopMonitor:
+    """
+    Tracks event loop lag with a heartbeat task and reports slow callbacks
+
+    A watchdog thread notices when the heartbeat is overdue and captures the
+    loop thread's stack at that moment, which names the blocking code (a
+    bcrypt verify, a large validation) without enabling asyncio debug mode.
+    """
+
+    def __init__(
+        self,
+        interval: float = LOOP_MONITOR_INTERVAL_SECONDS,
+        slow_threshold: float = LOOP_SLOW_CALLBACK_SECONDS,
+        history: int = LOOP_SLOW_CALLBACK_HISTORY
+    ):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.samples = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.slow_callbacks = deque(maxlen=history)
+        self.slow_callback_count = 0
+        self._recent_lags = deque(maxlen=600)
+        self._last_beat = None
+        self._blocked = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - expected, 0.0)
+            self._last_beat = now
+            self.samples += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            self._recent_lags.append(lag)
+            blocked = self._blocked
+            if blocked is not None:
+                self._blocked = None
+                blocked["duration_seconds"] = lag
+                self.slow_callbacks.append(blocked)
+                self.slow_callback_count += 1
+
+    def _watch(self, thread_id: int):
+        while not self._stop.wait(self.slow_threshold / 2):
+            last_beat = self._last_beat
+            if last_beat is None or self._blocked is not None:
+                continue
+            if time.monotonic() - last_beat > self.interval + self.slow_threshold:
+                self._blocked = {"detected_at": datetime.utcnow().isoformat(), "stack": thread_stack(thread_id)}
+
+    def start(self):
+        if not LOOP_MONITOR_ENABLED or self._task is not None:
+            return
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(
+            target=self._watch,
+            args=(threading.get_ident(),),
+            name="loop-watchdog",
+            daemon=True
+        )
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._watchdog = None
+
+    def report(self):
+        recent = sorted(self._recent_lags)
+
+        def percentile(fraction):
+            return recent[min(int(len(recent) * fraction), len(recent) - 1)] if recent else 0.0
+
+        return {
+            "enabled": self._task is not None,
+            "interval_seconds": self.interval,
+            "slow_callback_threshold_seconds": self.slow_threshold,
+            "lag_seconds": {
+                "avg": self.lag_total / self.samples if self.samples else 0.0,
+                "max": self.lag_max,
+                "p50_recent": percentile(0.5),
+                "p99_recent": percentile(0.99)
+            },
+            "tasks": len(asyncio.all_tasks()),
+            "slow_callback_count": self.slow_callback_count,
+            "slow_callbacks": list(self.slow_callbacks)
+        }
+
+profiler = SamplingProfiler()
+loop_monitor = LoopMonitor()
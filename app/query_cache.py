@@ -0,0 +1,199 @@
+from dotenv import load_dotenv
+from typing import Awaitable, Callable, Optional
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import time
+
+load_dotenv()
+
+# "memory://" for the in-process stand-in, "redis://host:6379/0" for a shared
+# tier across workers and replicas. Unset disables the cache.
+QUERY_CACHE_URL = os.getenv("QUERY_CACHE_URL")
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "30"))
+QUERY_CACHE_STALE_SECONDS = float(os.getenv("QUERY_CACHE_STALE_SECONDS", "30"))
+
+logger = logging.getLogger(__name__)
+
+class MemoryCacheBackend:
+    """In-process stand-in implementing the subset of Redis commands we use"""
+
+    def __init__(self):
+        self._data = {}
+
+    def _live(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._live(key)
+
+    async def mget(self, keys):
+        return [self._live(key) for key in keys]
+
+    async def set(self, key: str, value: bytes, ex: Optional[float] = None):
+        expires_at = time.monotonic() + ex if ex else None
+        self._data[key] = (value, expires_at)
+
+    async def incr(self, key: str) -> int:
+        value = int(self._live(key) or 0) + 1
+        self._data[key] = (str(value).encode(), None)
+        return value
+
+    async def close(self):
+        self._data.clear()
+
+class RedisCacheBackend:
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self._client = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._client.get(key)
+
+    async def mget(self, keys):
+        return await self._client.mget(keys)
+
+    async def set(self, key: str, value: bytes, ex: Optional[float] = None):
+        await self._client.set(key, value, px=int(ex * 1000) if ex else None)
+
+    async def incr(self, key: str) -> int:
+        return await self._client.incr(key)
+
+    async def close(self):
+        await self._client.aclose()
+
+def create_backend(url: Optional[str]):
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemoryCacheBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCacheBackend(url)
+    raise ValueError(f"Unsupported QUERY_CACHE_URL: {url}")
+
+class QueryCache:
+    """
+    Caches serialized responses keyed by normalized query parameters
+
+    Each entry is tagged. Invalidating a tag bumps its version counter, and the
+    version is part of the cache key, so old entries are never read again and
+    simply expire. Entries past their TTL are still served for up to
+    stale_seconds while a single background task recomputes them.
+    """
+
+    def __init__(self, backend=None, ttl: float = QUERY_CACHE_TTL_SECONDS, stale_seconds: float = QUERY_CACHE_STALE_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_seconds = stale_seconds
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._refreshing = set()
+        self._refresh_tasks = set()
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    @staticmethod
+    def make_key(namespace: str, params: dict) -> str:
+        normalized = json.dumps(params, sort_keys=True, default=str, separators=(",", ":"))
+        return f"qc:{namespace}:{hashlib.sha1(normalized.encode()).hexdigest()}"
+
+    async def _versioned_key(self, key: str, tag: str) -> str:
+        versions = await self.backend.mget(["qc:tagv:*", f"qc:tagv:{tag}"])
+        return f"{key}:{int(versions[0] or 0)}.{int(versions[1] or 0)}"
+
+    async def _store(self, key: str, value: bytes):
+        fresh_until = time.time() + self.ttl
+        await self.backend.set(key, f"{fresh_until}\n".encode() + value, ex=self.ttl + self.stale_seconds)
+
+    async def _refresh(self, key: str, compute: Callable[[], Awaitable[bytes]]):
+        try:
+            await self._store(key, await compute())
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Query cache refresh failed: %s", e)
+        finally:
+            self._refreshing.discard(key)
+
+    async def get_or_compute(self, namespace: str, tag: str, params: dict, compute: Callable[[], Awaitable[bytes]]) -> bytes:
+        if not self.enabled:
+            return await compute()
+
+        try:
+            key = await self._versioned_key(self.make_key(namespace, params), tag)
+            entry = await self.backend.get(key)
+        except Exception as e:
+            # The cache is an optimization, never fail the request because of it
+            self.errors += 1
+            logger.warning("Query cache unavailable: %s", e)
+            return await compute()
+
+        if entry is not None:
+            fresh_until, _, value = entry.partition(b"\n")
+            if float(fresh_until) > time.time():
+                self.hits += 1
+                return value
+            self.stale_hits += 1
+            if key not in self._refreshing:
+                self._refreshing.add(key)
+                # Fresh context so the refresh outlives the request's Mongo
+                # deadline and trace; the set keeps it from being collected
+                task = asyncio.create_task(self._refresh(key, compute), context=contextvars.Context())
+                self._refresh_tasks.add(task)
+                task.add_done_callback(self._refresh_tasks.discard)
+            return value
+
+        self.misses += 1
+        value = await compute()
+        try:
+            await self._store(key, value)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Query cache store failed: %s", e)
+        return value
+
+    async def invalidate(self, *tags: str):
+        if not self.enabled:
+            return
+        for tag in set(tags):
+            try:
+                await self.backend.incr(f"qc:tagv:{tag}")
+            except Exception as e:
+                self.errors += 1
+                logger.warning("Query cache invalidation failed for %s: %s", tag, e)
+
+    async def invalidate_all(self):
+        await self.invalidate("*")
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0
+        }
+
+    async def close(self):
+        for task in list(self._refresh_tasks):
+            task.cancel()
+        await asyncio.gather(*self._refresh_tasks, return_exceptions=True)
+        if self.backend is not None:
+            await self.backend.close()
+
+query_cache = QueryCache(create_backend(QUERY_CACHE_URL))
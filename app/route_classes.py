@@ -0,0 +1,20 @@
+# Coarse classes of routes that share timeouts and concurrency limits
+
+AUTH = "auth"
+READ = "read"
+WRITE = "write"
+EXPORT = "export"
+STREAM = "stream"
+
+STREAM_PATHS = ("/products/changes",)
+
+def route_class(method: str, path: str) -> str:
+    if path == "/token":
+        return AUTH
+    if path.startswith("/export/"):
+        return EXPORT
+    if path in STREAM_PATHS:
+        return STREAM
+    if method in ("GET", "HEAD", "OPTIONS"):
+        return READ
+    return WRITE
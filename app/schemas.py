@@ -1,11 +1,18 @@
-from pydantic import BaseModel, Field, BeforeValidator
-from typing import Optional, List, Annotated
+from pydantic import BaseModel, Field, BeforeValidator, field_validator
+from typing import Optional, List, Annotated, Dict
 from datetime import datetime
 from bson import ObjectId
 
 # Custom type for ObjectId fields
 PyObjectId = Annotated[str, BeforeValidator(lambda x: str(ObjectId(x)) if x else None)]
 
+def _not_null(value):
+    # Optional fields of partial updates may be left out, but an explicit
+    # null would write None over a required field
+    if value is None:
+        raise ValueError("must not be null, omit the field to leave it unchanged")
+    return value
+
 class CategoryBase(BaseModel):
     name: str
     description: Optional[str] = None
@@ -30,6 +37,66 @@ class ProductBase(BaseModel):
 class ProductCreate(ProductBase):
     pass
 
+class ProductUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    quantity: Optional[int] = None
+    category_id: Optional[str] = None
+
+    _no_nulls = field_validator("name", "price", "quantity", "category_id")(_not_null)
+
+class StockAdjustment(BaseModel):
+    delta: int
+    allow_negative: bool = False
+
+class StockAdjustmentItem(BaseModel):
+    product_id: str
+    delta: int
+
+class BulkStockAdjustment(BaseModel):
+    items: List[StockAdjustmentItem]
+    allow_negative: bool = False
+
+class BulkStockAdjustmentResult(BaseModel):
+    requested: int
+    matched_count: int
+    modified_count: int
+
+class ProductFilter(BaseModel):
+    category_id: Optional[str] = None
+    name: Optional[str] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    min_quantity: Optional[int] = None
+    in_stock: Optional[bool] = None
+    updated_after: Optional[datetime] = None
+
+class BulkProductFields(BaseModel):
+    description: Optional[str] = None
+    price: Optional[float] = None
+    quantity: Optional[int] = None
+    category_id: Optional[str] = None
+
+    _no_nulls = field_validator("price", "quantity", "category_id")(_not_null)
+
+class BulkProductUpdate(BaseModel):
+    filter: ProductFilter = ProductFilter()
+    set: Optional[BulkProductFields] = None
+    multiply_price: Optional[float] = Field(None, gt=0)
+    increment_quantity: Optional[int] = None
+    allow_negative: bool = False
+    dry_run: bool = False
+
+class BulkProductDelete(BaseModel):
+    filter: ProductFilter
+    dry_run: bool = False
+
+class BulkWriteResult(BaseModel):
+    dry_run: bool
+    matched_count: int
+    modified_count: int
+
 class ProductResponse(ProductBase):
     id: str = Field(alias="_id")
     created_at: datetime
@@ -39,6 +106,54 @@ class ProductResponse(ProductBase):
         json_encoders = {ObjectId: str}
         populate_by_name = True
 
+class ProductSuggestion(BaseModel):
+    id: str
+    name: str
+
+class CategoryCount(BaseModel):
+    category_id: PyObjectId
+    count: int
+
+class PriceBucket(BaseModel):
+    min: float
+    max: float
+    count: int
+
+class StockCounts(BaseModel):
+    in_stock: int
+    out_of_stock: int
+
+class ProductFacets(BaseModel):
+    total: int
+    results: List[ProductResponse]
+    categories: List[CategoryCount]
+    price_buckets: List[PriceBucket]
+    stock: StockCounts
+
+class PricePercentiles(BaseModel):
+    count: int
+    percentiles: Dict[str, Optional[float]]
+
+class Histogram(BaseModel):
+    count: int
+    edges: List[float]
+    counts: List[int]
+
+class CategoryStock(BaseModel):
+    category_id: Optional[PyObjectId] = None
+    products: int
+    total_quantity: int
+    mean_quantity: float
+    min_quantity: int
+    max_quantity: int
+    out_of_stock: int
+    stock_value: float
+
+class PriceQuantityCorrelation(BaseModel):
+    count: int
+    pearson: Optional[float] = None
+    spearman: Optional[float] = None
+
 class UserBase(BaseModel):
     email: str
 
@@ -56,6 +171,10 @@ class UserResponse(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     email: Optional[str] = None
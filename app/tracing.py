@@ -0,0 +1,237 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
+from fastapi import Request
+from fastapi.security import OAuth2PasswordBearer
+from pymongo import monitoring
+from typing import Optional
+import asyncio
+import json
+import logging
+import os
+import random
+import secrets
+import time
+import urllib.request
+
+load_dotenv()
+
+# Fraction of requests that are traced. Untraced requests only pay for one
+# random() call in the middleware and a ContextVar lookup per Mongo command.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+# Append OTLP/JSON trace requests, one per line, to this file
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")
+# Base URL of an OTLP/HTTP collector, e.g. http://localhost:4318
+TRACE_EXPORT_OTLP_ENDPOINT = os.getenv("TRACE_EXPORT_OTLP_ENDPOINT")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "product-management-api")
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+logger = logging.getLogger(__name__)
+
+current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.start_unix_ns = time.time_ns()
+        self.start = time.perf_counter()
+        self.end = None
+        self.status_code = None
+        self.spans = []
+
+    def add_span(self, name: str, start: float, end: float, kind: int = SPAN_KIND_INTERNAL, attributes: dict = None):
+        # Called from Motor's executor threads too; list.append is atomic
+        self.spans.append((name, start, end, kind, attributes or {}))
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+    def server_timing(self) -> str:
+        totals = {}
+        for name, start, end, _, _ in self.spans:
+            duration, count = totals.get(name, (0.0, 0))
+            totals[name] = (duration + end - start, count + 1)
+        entries = [
+            f'{name};dur={duration * 1000:.2f}' + (f';desc="x{count}"' if count > 1 else "")
+            for name, (duration, count) in totals.items()
+        ]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.2f}")
+        return ", ".join(entries)
+
+    def _unix_ns(self, perf_time: float) -> str:
+        return str(self.start_unix_ns + int((perf_time - self.start) * 1e9))
+
+    def to_otlp(self) -> dict:
+        def attributes(values):
+            return [{"key": key, "value": {"stringValue": str(value)}} for key, value in values.items()]
+
+        spans = [{
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KIND_SERVER,
+            "startTimeUnixNano": self._unix_ns(self.start),
+            "endTimeUnixNano": self._unix_ns(self.end or time.perf_counter()),
+            "attributes": attributes({"http.status_code": self.status_code})
+        }]
+        for name, start, end, kind, values in self.spans:
+            spans.append({
+                "traceId": self.trace_id,
+                "spanId": secrets.token_hex(8),
+                "parentSpanId": self.span_id,
+                "name": name,
+                "kind": kind,
+                "startTimeUnixNano": self._unix_ns(start),
+                "endTimeUnixNano": self._unix_ns(end),
+                "attributes": attributes(values)
+            })
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": attributes({"service.name": TRACE_SERVICE_NAME})},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}]
+            }]
+        }
+
+@contextmanager
+def span(name: str, **attributes):
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter(), attributes=attributes)
+
+class MongoCommandTracer(monitoring.CommandListener):
+    """Records every command issued through Motor as a span on the current trace"""
+
+    def started(self, event):
+        pass
+
+    def _record(self, event, outcome):
+        trace = current_trace.get()
+        if trace is None:
+            return
+        end = time.perf_counter()
+        trace.add_span(
+            f"mongo.{event.command_name}",
+            end - event.duration_micros / 1e6,
+            end,
+            kind=SPAN_KIND_CLIENT,
+            attributes={"db.system": "mongodb", "db.name": event.database_name, "outcome": outcome}
+        )
+
+    def succeeded(self, event):
+        self._record(event, "ok")
+
+    def failed(self, event):
+        self._record(event, "failed")
+
+mongo_command_tracer = MongoCommandTracer()
+
+class TracedOAuth2PasswordBearer(OAuth2PasswordBearer):
+    async def __call__(self, request: Request) -> Optional[str]:
+        with span("auth"):
+            return await super().__call__(request)
+
+class SpanExporter:
+    """Ships finished traces off the request path from a background task"""
+
+    def __init__(self, path: Optional[str] = TRACE_EXPORT_FILE, endpoint: Optional[str] = TRACE_EXPORT_OTLP_ENDPOINT, max_queue: int = 1000):
+        self.path = path
+        self.endpoint = endpoint.rstrip("/") + "/v1/traces" if endpoint else None
+        self.dropped = 0
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+
+    @property
+    def enabled(self):
+        return bool(self.path or self.endpoint)
+
+    def submit(self, trace: Trace):
+        if self._task is None:
+            return
+        try:
+            self._queue.put_nowait(trace)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _write(self, payloads):
+        if self.path:
+            with open(self.path, "a") as f:
+                for payload in payloads:
+                    f.write(json.dumps(payload) + "\n")
+        if self.endpoint:
+            for payload in payloads:
+                request = urllib.request.Request(
+                    self.endpoint,
+                    data=json.dumps(payload).encode(),
+                    headers={"Content-Type": "application/json"}
+                )
+                urllib.request.urlopen(request, timeout=5).close()
+
+    async def _run(self):
+        while True:
+            traces = [await self._queue.get()]
+            while not self._queue.empty() and len(traces) < 100:
+                traces.append(self._queue.get_nowait())
+            try:
+                await asyncio.to_thread(self._write, [trace.to_otlp() for trace in traces])
+            except Exception as e:
+                logger.warning("Trace export failed: %s", e)
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+span_exporter = SpanExporter()
+
+class TracingMiddleware:
+    """
+    Traces a sample of requests and reports the per-phase breakdown in a
+    Server-Timing response header
+    """
+
+    def __init__(self, app, sample_rate: float = TRACE_SAMPLE_RATE, exporter: SpanExporter = span_exporter):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(f"{scope['method']} {scope['path']}")
+        token = current_trace.set(trace)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                trace.status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_trace.reset(token)
+            trace.finish()
+            self.exporter.submit(trace)
@@ -0,0 +1,134 @@
+"""
+Compare the dict-based product export with the raw BSON export engine
+
+Runs on synthetic raw batches so no MongoDB is needed:
+
+    python benchmark_export.py --rows 200000 --batch-size 1000
+
+JSON is several times faster than the legacy export. CSV is not: both engines
+decode every document and spend most of their time in csv.writer, and the
+streaming path adds per-batch writer and generator overhead, so raw CSV
+measures about 5-15% slower (x0.86-0.95). What CSV gains is memory, since
+the legacy export held the whole result set before writing.
+"""
+from datetime import datetime
+from io import StringIO
+import argparse
+import asyncio
+import csv
+import json
+import time
+
+import bson
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from app import raw_export
+
+def make_batches(rows, batch_size):
+    now = datetime.utcnow().replace(microsecond=0)
+    categories = [ObjectId() for _ in range(20)]
+    batches = []
+    for start in range(0, rows, batch_size):
+        batches.append(b"".join(
+            bson.encode({
+                "_id": ObjectId(),
+                "name": f"Product {i}",
+                "description": f"Description for product {i}",
+                "price": round(i * 1.37 % 1000, 2),
+                "quantity": i % 50,
+                "category_id": categories[i % len(categories)],
+                "created_at": now,
+                "updated_at": now
+            })
+            for i in range(start, min(start + batch_size, rows))
+        ))
+    return batches
+
+def legacy_json(batches):
+    # Mirrors the original export_products_json: decode, mutate, jsonable_encoder
+    products_list = []
+    for batch in batches:
+        for product in bson.decode_all(batch):
+            product["id"] = str(product["_id"])
+            product["category_id"] = str(product["category_id"])
+            del product["_id"]
+            products_list.append(product)
+    return json.dumps(jsonable_encoder(products_list), ensure_ascii=False).encode()
+
+class _RawBatchCursor:
+    """Stands in for a Motor raw batch cursor over prebuilt batches"""
+
+    def __init__(self, batches):
+        self._batches = iter(batches)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._batches)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def close(self):
+        pass
+
+async def _collect(stream):
+    return "".join([chunk async for chunk in stream]).encode()
+
+def raw_json(batches):
+    return asyncio.run(_collect(raw_export.json_stream(_RawBatchCursor(batches))))
+
+def legacy_csv(batches):
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(raw_export.CSV_COLUMNS)
+    for batch in batches:
+        for product in bson.decode_all(batch):
+            writer.writerow([
+                str(product["_id"]),
+                product["name"],
+                product["description"],
+                product["price"],
+                product["quantity"],
+                str(product["category_id"]),
+                product["created_at"].isoformat() if "created_at" in product else "",
+                product["updated_at"].isoformat() if "updated_at" in product else ""
+            ])
+    return output.getvalue().encode()
+
+def raw_csv(batches):
+    return asyncio.run(_collect(raw_export.csv_stream(_RawBatchCursor(batches))))
+
+def measure(func, batches, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func(batches)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return output, rows / best, len(output) / best / 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    batches = make_batches(args.rows, args.batch_size)
+    print(f"{args.rows} rows, {sum(len(batch) for batch in batches) / 1e6:.1f} MB of BSON\n")
+    print(f"{'format':<6} {'engine':<8} {'rows/sec':>12} {'MB/sec':>8}")
+    for name, legacy, raw, parse in (
+        ("json", legacy_json, raw_json, json.loads),
+        ("csv", legacy_csv, raw_csv, lambda data: list(csv.reader(StringIO(data.decode()))))
+    ):
+        legacy_output, legacy_rows, legacy_mb = measure(legacy, batches, args.rows, args.repeat)
+        raw_output, raw_rows, raw_mb = measure(raw, batches, args.rows, args.repeat)
+        same = parse(legacy_output) == parse(raw_output)
+        print(f"{name:<6} {'legacy':<8} {legacy_rows:>12,.0f} {legacy_mb:>8.1f}")
+        print(f"{name:<6} {'raw':<8} {raw_rows:>12,.0f} {raw_mb:>8.1f}   x{raw_rows / legacy_rows:.2f}{'' if same else '  OUTPUT MISMATCH'}")
+
+if __name__ == "__main__":
+    main()
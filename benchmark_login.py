@@ -0,0 +1,101 @@
+"""
+Compare login throughput with a full bcrypt check on every call against the
+verified-credential cache and the refresh-token flow
+
+Runs the token code in-process, so no MongoDB or server is needed:
+
+    python benchmark_login.py --seconds 3
+
+Pass --url to measure a running server over HTTP instead (the user must exist):
+
+    python benchmark_login.py --url http://localhost:8000 --username admin@example.com --password testpass123
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+from datetime import timedelta
+
+from app import auth
+from app.credential_cache import CredentialCache
+
+def measure(name, func, seconds):
+    calls = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        func()
+        calls += 1
+    elapsed = time.perf_counter() - start
+    rate = calls / elapsed
+    print(f"{name:<28} {rate:>12,.0f} logins/sec {elapsed / calls * 1000:>10.3f} ms/login")
+    return rate
+
+def in_process(args):
+    email = args.username
+    password = args.password
+    hashed_password = auth.get_password_hash(password)
+    cache = CredentialCache(ttl=300)
+    expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
+
+    def legacy():
+        # What login_for_access_token did before: bcrypt and a fresh JWT every time
+        assert auth.verify_password(password, hashed_password)
+        auth.create_access_token(data={"sub": email}, expires_delta=expires)
+
+    def cached():
+        if not cache.verified(email, password, hashed_password):
+            assert auth.verify_password(password, hashed_password)
+            cache.add(email, password, hashed_password)
+        auth.create_access_token(data={"sub": email}, expires_delta=expires)
+        auth.create_refresh_token(email, hashed_password)
+
+    refresh_token = auth.create_refresh_token(email, hashed_password)
+
+    def refresh():
+        payload = auth.decode_refresh_token(refresh_token)
+        assert payload["pwv"] == auth.password_fingerprint(hashed_password)
+        auth.create_access_token(data={"sub": payload["sub"]}, expires_delta=expires)
+
+    baseline = measure("bcrypt every login (before)", legacy, args.seconds)
+    for name, func in (("credential cache hit", cached), ("refresh token", refresh)):
+        rate = measure(name, func, args.seconds)
+        print(f"{'':<28} x{rate / baseline:,.0f}")
+
+def over_http(args):
+    import requests
+
+    session = requests.Session()
+    form = {"username": args.username, "password": args.password}
+    response = session.post(f"{args.url}/token", data=form)
+    response.raise_for_status()
+    refresh_token = response.json()["refresh_token"]
+
+    def login():
+        session.post(f"{args.url}/token", data=form).raise_for_status()
+
+    def refresh():
+        session.post(f"{args.url}/token/refresh", json={"refresh_token": refresh_token}).raise_for_status()
+
+    baseline = measure("POST /token (cache warm)", login, args.seconds)
+    rate = measure("POST /token/refresh", refresh, args.seconds)
+    print(f"{'':<28} x{rate / baseline:,.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--url", help="benchmark a running server instead of in-process")
+    parser.add_argument("--username", default="admin@example.com")
+    parser.add_argument("--password", default="testpass123")
+    args = parser.parse_args()
+    if args.url:
+        over_http(args)
+    else:
+        in_process(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Measure export throughput as the number of parallel _id-range cursors grows
+
+By default runs against a simulated collection that answers every batch
+after a fixed round-trip delay, so no MongoDB is needed:
+
+    python benchmark_parallel_export.py --rows 200000 --latency-ms 5
+
+Pass --url to export the products collection of a live database instead:
+
+    python benchmark_parallel_export.py --url mongodb://localhost:27017 --database productdb
+"""
+from datetime import datetime
+import argparse
+import asyncio
+import bisect
+import random
+import time
+
+import bson
+from bson import ObjectId
+
+from app import raw_export
+
+class _SimulatedCursor:
+    def __init__(self, batches, latency):
+        self._batches = iter(batches)
+        self._latency = latency
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        batch = next(self._batches, None)
+        if batch is None:
+            raise StopAsyncIteration
+        await asyncio.sleep(self._latency)
+        return batch
+
+    async def close(self):
+        pass
+
+class _SimulatedAggregate:
+    def __init__(self, documents):
+        self._documents = documents
+
+    async def to_list(self, length):
+        return self._documents
+
+class SimulatedCollection:
+    """Sorted in-memory products answering find_raw_batches by _id range"""
+
+    def __init__(self, rows, latency):
+        now = datetime.utcnow().replace(microsecond=0)
+        categories = [ObjectId() for _ in range(20)]
+        self.ids = sorted(ObjectId() for _ in range(rows))
+        self.documents = [
+            bson.encode({
+                "_id": product_id,
+                "name": f"Product {i}",
+                "description": f"Description for product {i}",
+                "price": round(i * 1.37 % 1000, 2),
+                "quantity": i % 50,
+                "category_id": categories[i % len(categories)],
+                "created_at": now,
+                "updated_at": now
+            })
+            for i, product_id in enumerate(self.ids)
+        ]
+        self.latency = latency
+
+    async def estimated_document_count(self):
+        return len(self.ids)
+
+    def aggregate(self, pipeline):
+        size = pipeline[0]["$sample"]["size"]
+        return _SimulatedAggregate([{"_id": product_id} for product_id in random.sample(self.ids, min(size, len(self.ids)))])
+
+    def find_raw_batches(self, query, projection=None, sort=None, batch_size=1000):
+        id_range = query.get("_id", {})
+        start = bisect.bisect_left(self.ids, id_range["$gte"]) if "$gte" in id_range else 0
+        end = bisect.bisect_left(self.ids, id_range["$lt"]) if "$lt" in id_range else len(self.ids)
+        batches = [
+            b"".join(self.documents[offset:min(offset + batch_size, end)])
+            for offset in range(start, end, batch_size)
+        ]
+        return _SimulatedCursor(batches, self.latency)
+
+async def export(collection, parallelism, batch_size, partition_rows, csv):
+    bounds = await raw_export.partition_bounds(collection, parallelism, partition_rows)
+    stream = (raw_export.parallel_csv_stream if csv else raw_export.parallel_json_stream)(collection, bounds, parallelism, batch_size)
+    return "".join([chunk async for chunk in stream]).encode()
+
+async def run(collection, rows, args):
+    print(f"{'format':<6} {'parallel':>8} {'rows/sec':>12} {'MB/sec':>8}")
+    for name, csv in (("json", False), ("csv", True)):
+        reference = None
+        baseline = None
+        for parallelism in args.parallelism:
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                output = await export(collection, parallelism, args.batch_size, args.partition_rows, csv)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            reference = reference or output
+            baseline = baseline or best
+            note = "" if output == reference else "  OUTPUT MISMATCH"
+            print(f"{name:<6} {parallelism:>8} {rows / best:>12,.0f} {len(output) / best / 1e6:>8.1f}   x{baseline / best:.2f}{note}")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--partition-rows", type=int, default=20000)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="simulated round trip per batch")
+    parser.add_argument("--parallelism", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--url", help="MongoDB URL to benchmark against instead of the simulation")
+    parser.add_argument("--database", default="productdb")
+    args = parser.parse_args()
+
+    if args.url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.url)
+        collection = client[args.database].products
+        rows = await collection.estimated_document_count()
+        print(f"{rows} rows in {args.database}.products\n")
+        await run(collection, rows, args)
+        client.close()
+    else:
+        collection = SimulatedCollection(args.rows, args.latency_ms / 1000)
+        print(f"{args.rows} simulated rows, {args.latency_ms} ms per batch round trip\n")
+        await run(collection, args.rows, args)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,5 +1,6 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from app.auth import get_password_hash
+from app.indexes import ensure_indexes
 import asyncio
 from dotenv import load_dotenv
 import os
@@ -15,10 +16,7 @@ async def init_mongodb():
     db = client[MONGODB_DB]
     
     # Create indexes
-    await db.categories.create_index("name", unique=True)
-    await db.users.create_index("email", unique=True)
-    await db.products.create_index("name")
-    await db.products.create_index("category_id")
+    await ensure_indexes(db)
     
     # Create default user if not exists
     default_user = {
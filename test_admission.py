@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from app.admission import Pool
+
+async def queued(pool):
+    """Start an acquire that has to wait, and let it enter the queue"""
+    task = asyncio.create_task(pool.acquire())
+    await asyncio.sleep(0)
+    return task
+
+def test_rejects_when_queue_is_full():
+    async def run():
+        pool = Pool("test", limit=1, max_queue=1, queue_timeout=1.0)
+        assert await pool.acquire()
+        waiter = await queued(pool)
+        assert not await pool.acquire()
+        assert pool.rejected_queue_full == 1
+        pool.release()
+        assert await waiter
+        pool.release()
+        assert pool.active == 0
+    asyncio.run(run())
+
+def test_rejects_after_queue_timeout():
+    async def run():
+        pool = Pool("test", limit=1, max_queue=4, queue_timeout=0.05)
+        assert await pool.acquire()
+        assert not await pool.acquire()
+        assert pool.rejected_timeout == 1
+        assert pool.stats()["queued"] == 0
+        assert pool.active == 1
+    asyncio.run(run())
+
+def test_release_hands_slot_to_waiters_in_order():
+    async def run():
+        pool = Pool("test", limit=1, max_queue=4, queue_timeout=1.0)
+        assert await pool.acquire()
+        admitted = []
+
+        async def wait(name):
+            assert await pool.acquire()
+            admitted.append(name)
+
+        first = asyncio.create_task(wait("first"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(wait("second"))
+        await asyncio.sleep(0)
+
+        pool.release()
+        await first
+        # The slot moved to the waiter, it was never given back in between
+        assert pool.active == 1
+        pool.release()
+        await second
+        pool.release()
+        assert admitted == ["first", "second"]
+        assert pool.active == 0
+        assert pool.admitted == 3
+    asyncio.run(run())
+
+def test_new_arrivals_do_not_jump_the_queue():
+    async def run():
+        pool = Pool("test", limit=1, max_queue=4, queue_timeout=0.05)
+        assert await pool.acquire()
+        waiter = await queued(pool)
+        pool.release()
+        # The released slot belongs to the waiter, not to a newcomer
+        assert not await pool.acquire()
+        assert await waiter
+    asyncio.run(run())
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        pool = Pool("test", limit=1, max_queue=4, queue_timeout=1.0)
+        assert await pool.acquire()
+        waiter = await queued(pool)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert pool.stats()["queued"] == 0
+        pool.release()
+        assert pool.active == 0
+    asyncio.run(run())
+
+def test_cancel_after_handoff_returns_the_slot():
+    async def run():
+        pool = Pool("test", limit=1, max_queue=4, queue_timeout=1.0)
+        assert await pool.acquire()
+        waiter = await queued(pool)
+        # The slot is handed over, then the waiter is cancelled before it runs
+        pool.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert pool.active == 0
+        assert await pool.acquire()
+    asyncio.run(run())
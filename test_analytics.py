@@ -0,0 +1,116 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from app.analytics import ProductSnapshot
+
+NOW = datetime(2024, 1, 1)
+
+def product(product_id, price, quantity, category_id, updated_at=NOW):
+    return {"_id": product_id, "price": price, "quantity": quantity, "category_id": category_id, "updated_at": updated_at}
+
+def snapshot_of(products):
+    snapshot = ProductSnapshot()
+    snapshot.columns = snapshot._columns(products).sorted()
+    return snapshot
+
+def rows(snapshot):
+    columns = snapshot.columns
+    return {
+        ObjectId(product_id): (float(price), int(quantity), snapshot.categories[code])
+        for product_id, price, quantity, code in zip(columns.ids, columns.price, columns.quantity, columns.category)
+    }
+
+def test_merge_overwrites_existing_and_inserts_new_rows_in_order():
+    category, other = ObjectId(), ObjectId()
+    ids = sorted(ObjectId() for _ in range(6))
+    # Existing rows at positions 1, 3, 4; new ones before, between and after them
+    snapshot = snapshot_of([product(ids[i], 10.0 * i, i, category) for i in (1, 3, 4)])
+
+    snapshot.merge([
+        product(ids[5], 5.5, 50, other),
+        product(ids[3], 99.0, 0, other),
+        product(ids[0], 1.0, 10, category),
+        product(ids[2], 2.0, 20, category)
+    ])
+
+    columns = snapshot.columns
+    assert list(columns.ids) == [product_id.binary for product_id in ids]
+    assert len({len(array) for array in columns._arrays()}) == 1
+    assert rows(snapshot) == {
+        ids[0]: (1.0, 10, category),
+        ids[1]: (10.0, 1, category),
+        ids[2]: (2.0, 20, category),
+        ids[3]: (99.0, 0, other),
+        ids[4]: (40.0, 4, category),
+        ids[5]: (5.5, 50, other)
+    }
+
+def test_merge_into_empty_snapshot():
+    snapshot = snapshot_of([])
+    ids = [ObjectId(), ObjectId()]
+    snapshot.merge([product(ids[1], 2.0, 2, None), product(ids[0], 1.0, 1, None)])
+    assert list(snapshot.columns.ids) == sorted(product_id.binary for product_id in ids)
+
+def test_merge_overwrite_only_keeps_arrays():
+    product_id = ObjectId()
+    snapshot = snapshot_of([product(product_id, 1.0, 1, None)])
+    ids_before = snapshot.columns.ids
+    snapshot.merge([product(product_id, 3.0, 0, None)])
+    assert snapshot.columns.ids is ids_before
+    assert snapshot.columns.price.tolist() == [3.0]
+
+def test_queries():
+    category, other = ObjectId(), ObjectId()
+    snapshot = snapshot_of(
+        [product(ObjectId(), float(price), price % 3, category) for price in range(1, 11)]
+        + [product(ObjectId(), 100.0, 0, other)]
+    )
+    assert snapshot.price_percentiles([50], category)["percentiles"]["50"] == pytest.approx(5.5)
+    assert snapshot.price_percentiles([50], ObjectId())["count"] == 0
+
+    histogram = snapshot.histogram("price", 2, category)
+    assert histogram["counts"] == [5, 5]
+    with pytest.raises(ValueError):
+        snapshot.histogram("price", 2, category, lower=50)
+
+    stock = {row["category_id"]: row for row in snapshot.stock_by_category()}
+    assert stock[category]["products"] == 10
+    assert stock[category]["total_quantity"] == sum(price % 3 for price in range(1, 11))
+    assert stock[category]["out_of_stock"] == 3
+    assert stock[other]["stock_value"] == 0.0
+
+def test_refresh_applies_updated_at_deltas():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def run():
+        db = mongomock_motor.AsyncMongoMockClient()["analytics_test"]
+        category = ObjectId()
+        first, second = ObjectId(), ObjectId()
+        await db.products.insert_many([
+            product(first, 1.0, 1, category, NOW - timedelta(hours=1)),
+            product(second, 2.0, 2, category, NOW - timedelta(hours=1))
+        ])
+        snapshot = ProductSnapshot()
+        snapshot._source = lambda db: db.products
+        await snapshot.refresh(db)
+        assert len(snapshot.columns) == 2
+
+        added = ObjectId()
+        await db.products.update_one({"_id": first}, {"$set": {"price": 7.0, "updated_at": NOW}})
+        await db.products.insert_one(product(added, 3.0, 3, category, NOW))
+        await snapshot.refresh(db)
+        assert rows(snapshot)[first] == (7.0, 1, category)
+        assert added in rows(snapshot)
+        assert snapshot.watermark == NOW
+
+        # A delete is not visible in updated_at, the shrinking count triggers a rebuild
+        await db.products.delete_one({"_id": second})
+        await snapshot.refresh(db)
+        assert set(rows(snapshot)) == {first, added}
+        assert np.all(np.diff(snapshot.columns.ids.view(np.uint8).reshape(-1, 12), axis=0).any(axis=1))
+
+    asyncio.run(run())
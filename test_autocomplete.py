@@ -0,0 +1,85 @@
+import asyncio
+
+from bson import ObjectId
+
+from app.autocomplete import PrefixIndex
+
+class _SnapshotCursor:
+    """Yields products like a find() cursor and runs a hook partway through"""
+
+    def __init__(self, products, after_first=None):
+        self.products = products
+        self.after_first = after_first
+
+    def batch_size(self, size):
+        return self
+
+    async def __aiter__(self):
+        for position, product in enumerate(self.products):
+            yield product
+            if position == 0 and self.after_first:
+                self.after_first()
+
+class _Collection:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def find(self, query, projection):
+        return self.cursor
+
+class _Database:
+    def __init__(self, cursor):
+        self.products = _Collection(cursor)
+
+def names(index, prefix=""):
+    return [result["name"] for result in index.search(prefix, limit=100)]
+
+def test_search_is_prefix_ordered_and_normalized():
+    index = PrefixIndex()
+    for name in ["Banana Bread", "apple pie", "Apple  Juice", "Apricot"]:
+        index.add(ObjectId(), name)
+    assert names(index, "ap") == ["Apple  Juice", "apple pie", "Apricot"]
+    assert names(index, "APPLE J") == ["Apple  Juice"]
+    assert names(index, "cherry") == []
+    assert len(index.search("a", limit=2)) == 2
+
+def test_add_is_idempotent_and_remove_matches_id():
+    index = PrefixIndex()
+    first, second = ObjectId(), ObjectId()
+    index.add(first, "Widget")
+    index.add(first, "Widget")
+    index.add(second, "Widget")
+    assert len(index) == 2
+    index.remove(first, "Widget")
+    assert [result["id"] for result in index.search("wid")] == [str(second)]
+
+def test_rename_moves_entry():
+    index = PrefixIndex()
+    product = ObjectId()
+    index.add(product, "Old Name")
+    index.rename(product, "Old Name", "New Name")
+    assert names(index) == ["New Name"]
+
+def test_writes_during_rebuild_are_replayed():
+    index = PrefixIndex()
+    renamed, removed, added = ObjectId(), ObjectId(), ObjectId()
+    index.add(renamed, "Apple")
+    index.add(removed, "Banana")
+
+    def concurrent_writes():
+        # These land after the snapshot read "Apple" but before it is swapped in
+        index.rename(renamed, "Apple", "Apricot")
+        index.remove(removed, "Banana")
+        index.add(added, "Cherry")
+
+    snapshot = [
+        {"_id": renamed, "name": "Apple"},
+        {"_id": removed, "name": "Banana"},
+        # The snapshot may already contain a product added meanwhile
+        {"_id": added, "name": "Cherry"}
+    ]
+    asyncio.run(index.load(_Database(_SnapshotCursor(snapshot, concurrent_writes))))
+
+    assert index.loaded
+    assert names(index) == ["Apricot", "Cherry"]
+    assert index._pending is None
@@ -0,0 +1,226 @@
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
+
+os.environ.setdefault("SECRET_KEY", "change-feed-test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "10")
+
+from app.change_feed import ChangeFeed, InvalidResumeToken, Subscription
+
+# The docker-compose MongoDB is a single-node replica set named rs0. From the
+# host, connect directly since the member is registered as mongodb:27017.
+MONGODB_URL = os.getenv("MONGODB_TEST_URL", "mongodb://localhost:27017/?directConnection=true")
+TEST_DB = "productdb_change_feed_test"
+
+async def get_test_db():
+    client = AsyncIOMotorClient(MONGODB_URL, serverSelectionTimeoutMS=1000)
+    try:
+        hello = await client.admin.command("hello")
+    except Exception:
+        client.close()
+        pytest.skip(f"MongoDB not reachable at {MONGODB_URL}")
+    if "setName" not in hello:
+        client.close()
+        pytest.skip("Change streams need MongoDB running as a replica set")
+    await client.drop_database(TEST_DB)
+    return client, client[TEST_DB]
+
+async def next_message(changes):
+    while True:
+        message = await asyncio.wait_for(changes.__anext__(), 10)
+        if message is not None:
+            return message
+
+def product(name, category_id):
+    now = datetime.utcnow()
+    return {
+        "name": name,
+        "price": 10.0,
+        "quantity": 1,
+        "category_id": category_id,
+        "created_at": now,
+        "updated_at": now
+    }
+
+def test_change_feed_filters_and_resumes():
+    async def run():
+        client, db = await get_test_db()
+        feed = ChangeFeed()
+        try:
+            category = (await db.categories.insert_one({"name": "Watched"})).inserted_id
+            other = (await db.categories.insert_one({"name": "Ignored"})).inserted_id
+            await db.products.insert_one(product("seed", category))
+
+            changes = await feed.subscribe(db, Subscription({category}, {"price"}))
+            first = asyncio.ensure_future(next_message(changes))
+            # Give the shared stream time to open before writing
+            await asyncio.sleep(1)
+            await db.products.insert_one(product("other category", other))
+            await db.products.update_one({"name": "seed"}, {"$set": {"name": "renamed"}})
+            await db.products.update_one({"name": "renamed"}, {"$set": {"price": 12.5}})
+            message = await first
+            assert "event: update" in message
+            assert '"updated_fields": {"price": 12.5}' in message
+            resume_token = message.split("\n")[0][len("id: "):]
+            await changes.aclose()
+            assert feed.subscriber_count == 0
+
+            await db.products.update_one({"name": "renamed"}, {"$set": {"price": 15.0}})
+            resumed = await feed.subscribe(db, Subscription({category}, {"price"}), resume_after=resume_token)
+            message = await next_message(resumed)
+            assert '"updated_fields": {"price": 15.0}' in message
+            await resumed.aclose()
+        finally:
+            await feed.stop()
+            await client.drop_database(TEST_DB)
+            client.close()
+
+    asyncio.run(run())
+
+class _Products:
+    """Stands in for db.products: an oplog of changes that watch() streams read from"""
+
+    def __init__(self):
+        self.log = []
+        self.watches = []
+        self.appended = asyncio.Event()
+
+    def append(self, name, price=10.0):
+        token = {"_data": f"{len(self.log) + 1:08X}"}
+        self.log.append({
+            "_id": token,
+            "operationType": "insert",
+            "documentKey": {"_id": ObjectId()},
+            "fullDocument": {"name": name, "price": price, "category_id": None}
+        })
+        self.appended.set()
+        self.appended = asyncio.Event()
+        return token["_data"]
+
+    def watch(self, pipeline, full_document=None, resume_after=None, max_await_time_ms=None):
+        stream = _Stream(self, resume_after)
+        self.watches.append(stream)
+        return stream
+
+class _Stream:
+    def __init__(self, products, resume_after):
+        self.products = products
+        self.resume_after = resume_after
+        self.position = None
+        self.closed = False
+
+    @property
+    def alive(self):
+        return not self.closed
+
+    async def __aenter__(self):
+        if self.resume_after is None:
+            self.position = len(self.products.log)
+        else:
+            tokens = [change["_id"] for change in self.products.log]
+            if self.resume_after not in tokens:
+                raise OperationFailure("resume token was not found", 260, {"errmsg": "resume token was not found"})
+            self.position = tokens.index(self.resume_after) + 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        self.closed = True
+
+    async def try_next(self):
+        if self.position == len(self.products.log):
+            try:
+                await asyncio.wait_for(self.products.appended.wait(), 0.05)
+            except asyncio.TimeoutError:
+                return None
+        change = self.products.log[self.position]
+        self.position += 1
+        return change
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            change = await self.try_next()
+            if change is not None:
+                return change
+
+class _Database:
+    def __init__(self):
+        self.products = _Products()
+
+def names(messages):
+    return [message.split('"name": "')[1].split('"')[0] for message in messages]
+
+async def take(changes, count):
+    return [await next_message(changes) for _ in range(count)]
+
+def test_reconnect_within_replay_buffer_joins_shared_stream():
+    async def run():
+        db = _Database()
+        feed = ChangeFeed(replay_size=10)
+        changes = await feed.subscribe(db, Subscription())
+        first = asyncio.ensure_future(take(changes, 3))
+        await asyncio.sleep(0.01)
+        tokens = [db.products.append(name) for name in ("a", "b", "c")]
+        assert names(await first) == ["a", "b", "c"]
+
+        # Keep the shared stream open while the first client reconnects
+        other = await feed.subscribe(db, Subscription())
+        await changes.aclose()
+        resumed = await feed.subscribe(db, Subscription(), resume_after=tokens[0])
+        assert names(await take(resumed, 2)) == ["b", "c"]
+        db.products.append("d")
+        assert names(await take(resumed, 1)) == ["d"]
+        # Only the shared stream was ever opened
+        assert len(db.products.watches) == 1
+        assert feed.subscriber_count == 2
+        await resumed.aclose()
+        await other.aclose()
+        await feed.stop()
+    asyncio.run(run())
+
+def test_old_token_catches_up_then_hands_over():
+    async def run():
+        db = _Database()
+        feed = ChangeFeed(replay_size=2)
+        changes = await feed.subscribe(db, Subscription())
+        first = asyncio.ensure_future(take(changes, 5))
+        await asyncio.sleep(0.01)
+        tokens = [db.products.append(name) for name in ("a", "b", "c", "d", "e")]
+        await first
+
+        # "a" has left the two-change replay buffer, a private stream reads
+        # "b" and "c" and hands over once it reaches buffered "d"
+        resumed = await feed.subscribe(db, Subscription(), resume_after=tokens[0])
+        assert names(await take(resumed, 4)) == ["b", "c", "d", "e"]
+        private = db.products.watches[1]
+        assert private.closed
+        db.products.append("f")
+        assert names(await take(resumed, 1)) == ["f"]
+        assert feed.subscriber_count == 2
+        await resumed.aclose()
+        await changes.aclose()
+        assert feed.subscriber_count == 0
+        assert feed._task is None
+    asyncio.run(run())
+
+def test_bad_resume_tokens_are_rejected_up_front():
+    async def run():
+        db = _Database()
+        feed = ChangeFeed()
+        with pytest.raises(InvalidResumeToken):
+            await feed.subscribe(db, Subscription(), resume_after="not a token")
+        with pytest.raises(InvalidResumeToken):
+            await feed.subscribe(db, Subscription(), resume_after="DEADBEEF")
+        assert feed._task is None
+    asyncio.run(run())
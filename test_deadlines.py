@@ -0,0 +1,139 @@
+import asyncio
+
+import pymongo
+import pytest
+from pymongo import _csot
+from pymongo.errors import ExecutionTimeout
+
+from app import deadlines
+from app.deadlines import DeadlineMiddleware, DeadlineStats, request_timeout
+
+def scope(method="GET", path="/products/", headers=()):
+    return {"type": "http", "method": method, "path": path, "headers": list(headers)}
+
+class Client:
+    """Fake ASGI receive/send pair: messages are fed in, sent ones recorded"""
+
+    def __init__(self):
+        self.incoming = asyncio.Queue()
+        self.sent = []
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    @property
+    def status(self):
+        return next(message["status"] for message in self.sent if message["type"] == "http.response.start")
+
+async def respond(send, status=200, body=b"ok"):
+    await send({"type": "http.response.start", "status": status, "headers": []})
+    await send({"type": "http.response.body", "body": body})
+
+def test_first_message_reaches_the_handler_and_deadline_applies():
+    async def run():
+        seen = {}
+
+        async def app(scope, receive, send):
+            seen["message"] = await receive()
+            seen["timeout"] = _csot.get_timeout()
+            await respond(send)
+
+        client = Client()
+        client.incoming.put_nowait({"type": "http.request", "body": b"", "more_body": False})
+        await DeadlineMiddleware(app, DeadlineStats())(scope(headers=[(b"x-request-timeout", b"2")]), client.receive, client.send)
+        assert seen == {"message": {"type": "http.request", "body": b"", "more_body": False}, "timeout": 2.0}
+        assert client.status == 200
+    asyncio.run(run())
+
+def test_disconnect_cancels_the_handler():
+    async def run():
+        started, cancelled = asyncio.Event(), asyncio.Event()
+
+        async def app(scope, receive, send):
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        stats = DeadlineStats()
+        client = Client()
+        client.incoming.put_nowait({"type": "http.request", "body": b"", "more_body": False})
+        middleware = asyncio.ensure_future(DeadlineMiddleware(app, stats)(scope(), client.receive, client.send))
+        await started.wait()
+        client.incoming.put_nowait({"type": "http.disconnect"})
+        await asyncio.wait_for(middleware, 1)
+        assert cancelled.is_set()
+        assert stats.cancelled == 1
+        assert client.sent == []
+    asyncio.run(run())
+
+def test_timeout_before_response_is_a_504():
+    async def run():
+        async def app(scope, receive, send):
+            raise ExecutionTimeout("operation exceeded time limit", 50)
+
+        stats = DeadlineStats()
+        client = Client()
+        await DeadlineMiddleware(app, stats)(scope(), client.receive, client.send)
+        assert client.status == 504
+        assert b"deadline" in client.sent[1]["body"]
+        assert stats.timed_out == 1
+    asyncio.run(run())
+
+def test_timeout_after_response_start_is_reraised():
+    async def run():
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            raise ExecutionTimeout("operation exceeded time limit", 50)
+
+        stats = DeadlineStats()
+        client = Client()
+        with pytest.raises(ExecutionTimeout):
+            await DeadlineMiddleware(app, stats)(scope(), client.receive, client.send)
+        assert [message["type"] for message in client.sent] == ["http.response.start"]
+        assert stats.timed_out == 1
+    asyncio.run(run())
+
+def test_other_mongo_errors_are_not_timeouts():
+    async def run():
+        async def app(scope, receive, send):
+            raise pymongo.errors.OperationFailure("bad query", 2)
+
+        stats = DeadlineStats()
+        client = Client()
+        with pytest.raises(pymongo.errors.OperationFailure):
+            await DeadlineMiddleware(app, stats)(scope(), client.receive, client.send)
+        assert stats.timed_out == 0
+        assert client.sent == []
+    asyncio.run(run())
+
+def test_requests_with_a_body_read_it_directly():
+    async def run():
+        async def app(scope, receive, send):
+            first = await receive()
+            second = await receive()
+            await respond(send, body=first["body"] + second["body"])
+
+        client = Client()
+        client.incoming.put_nowait({"type": "http.request", "body": b"a", "more_body": True})
+        client.incoming.put_nowait({"type": "http.request", "body": b"b", "more_body": False})
+        request = scope("POST", headers=[(b"content-length", b"2")])
+        await DeadlineMiddleware(app, DeadlineStats())(request, client.receive, client.send)
+        assert client.sent[1]["body"] == b"ab"
+    asyncio.run(run())
+
+def test_timeout_header_can_only_shorten_the_route_default():
+    default = deadlines.ROUTE_TIMEOUTS["read"]
+    assert request_timeout(scope()) == default
+    assert request_timeout(scope(headers=[(b"x-request-timeout", b"0.5")])) == 0.5
+    assert request_timeout(scope(headers=[(b"x-request-timeout", str(default * 10).encode())])) == default
+    assert request_timeout(scope(headers=[(b"x-request-timeout", b"soon")])) == default
+    assert request_timeout(scope(headers=[(b"x-request-timeout", b"-1")])) == default
+    # Streams have no deadline unless the client asks for one
+    assert request_timeout(scope(path="/products/changes")) is None
+    assert request_timeout(scope(path="/products/changes", headers=[(b"x-request-timeout", b"30")])) == 30.0
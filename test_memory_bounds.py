@@ -0,0 +1,91 @@
+import asyncio
+import os
+import tracemalloc
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorClient
+
+os.environ.setdefault("SECRET_KEY", "memory-test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "10")
+
+from app import main
+from app.limits import document_sizes
+
+MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+TEST_DB = "productdb_memory_test"
+COLLECTION_SIZES = [1000, 4000, 16000]
+PAGE_SIZE = 100
+
+async def get_test_db():
+    client = AsyncIOMotorClient(MONGODB_URL, serverSelectionTimeoutMS=1000)
+    try:
+        await client.admin.command("ping")
+    except Exception:
+        client.close()
+        pytest.skip(f"MongoDB not reachable at {MONGODB_URL}")
+    await client.drop_database(TEST_DB)
+    return client, client[TEST_DB]
+
+async def grow_products(db, count, category_id):
+    now = datetime.utcnow()
+    await db.products.insert_many([
+        {
+            "name": f"Product {i}",
+            "description": "x" * 200,
+            "price": float(i % 500),
+            "quantity": i % 20,
+            "category_id": category_id,
+            "created_at": now,
+            "updated_at": now
+        }
+        for i in range(count)
+    ])
+
+async def measure_read_products(db):
+    tracemalloc.start()
+    try:
+        await main.read_products(skip=0, limit=PAGE_SIZE, sort=None, query={}, db=db, token="test")
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def test_read_products_peak_memory_is_flat():
+    async def run():
+        client, db = await get_test_db()
+        try:
+            category = await db.categories.insert_one({"name": "Memory"})
+            peaks = []
+            total = 0
+            for size in COLLECTION_SIZES:
+                await grow_products(db, size - total, category.inserted_id)
+                total = size
+                document_sizes._sizes.clear()
+                # Warm up once so one-time allocations are not counted
+                await measure_read_products(db)
+                peaks.append(await measure_read_products(db))
+            return peaks
+        finally:
+            await client.drop_database(TEST_DB)
+            client.close()
+
+    peaks = asyncio.run(run())
+    print(f"Peak allocation per request: {dict(zip(COLLECTION_SIZES, peaks))}")
+    assert max(peaks) <= min(peaks) * 1.5 + 64 * 1024
+
+def test_page_over_byte_budget_is_rejected():
+    async def run():
+        client, db = await get_test_db()
+        try:
+            await db.products.insert_one({"name": "Big", "description": "x" * 1024 * 1024})
+            document_sizes._sizes.clear()
+            with pytest.raises(HTTPException) as exc_info:
+                await main.check_page_budget(db.products, 100)
+            return exc_info.value.status_code
+        finally:
+            await client.drop_database(TEST_DB)
+            client.close()
+
+    assert asyncio.run(run()) == 413
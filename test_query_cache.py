@@ -0,0 +1,101 @@
+import asyncio
+import contextvars
+
+from app.query_cache import MemoryCacheBackend, QueryCache
+
+class Counter:
+    """compute() stand-in that returns a new value on every call"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return f"value-{self.calls}".encode()
+
+def test_miss_then_hit():
+    async def run():
+        cache = QueryCache(MemoryCacheBackend(), ttl=60, stale_seconds=0)
+        compute = Counter()
+        assert await cache.get_or_compute("products", "products", {"a": 1}, compute) == b"value-1"
+        assert await cache.get_or_compute("products", "products", {"a": 1}, compute) == b"value-1"
+        assert await cache.get_or_compute("products", "products", {"a": 2}, compute) == b"value-2"
+        assert compute.calls == 2
+        assert (cache.hits, cache.misses) == (1, 2)
+    asyncio.run(run())
+
+def test_invalidate_only_bumps_its_tag():
+    async def run():
+        cache = QueryCache(MemoryCacheBackend(), ttl=60, stale_seconds=0)
+        products, categories = Counter(), Counter()
+        await cache.get_or_compute("products", "products", {}, products)
+        await cache.get_or_compute("categories", "categories", {}, categories)
+
+        await cache.invalidate("products")
+        assert await cache.get_or_compute("products", "products", {}, products) == b"value-2"
+        assert await cache.get_or_compute("categories", "categories", {}, categories) == b"value-1"
+
+        await cache.invalidate_all()
+        assert await cache.get_or_compute("products", "products", {}, products) == b"value-3"
+        assert await cache.get_or_compute("categories", "categories", {}, categories) == b"value-2"
+    asyncio.run(run())
+
+def test_stale_entry_is_served_while_one_refresh_runs():
+    async def run():
+        cache = QueryCache(MemoryCacheBackend(), ttl=0.05, stale_seconds=60)
+        deadline = contextvars.ContextVar("deadline", default=None)
+        seen = []
+        compute = Counter()
+
+        async def slow_compute():
+            seen.append(deadline.get())
+            await asyncio.sleep(0.01)
+            return await compute()
+
+        await cache.get_or_compute("products", "products", {}, slow_compute)
+        await asyncio.sleep(0.06)
+
+        deadline.set("request deadline")
+        assert await cache.get_or_compute("products", "products", {}, slow_compute) == b"value-1"
+        assert await cache.get_or_compute("products", "products", {}, slow_compute) == b"value-1"
+        assert cache.stale_hits == 2
+        assert len(cache._refresh_tasks) == 1
+
+        await asyncio.gather(*cache._refresh_tasks)
+        assert not cache._refresh_tasks
+        # The refresh ran without the request's context variables
+        assert seen == [None, None]
+        assert await cache.get_or_compute("products", "products", {}, slow_compute) == b"value-2"
+        assert compute.calls == 2
+    asyncio.run(run())
+
+def test_close_cancels_pending_refresh():
+    async def run():
+        cache = QueryCache(MemoryCacheBackend(), ttl=0.01, stale_seconds=60)
+        hang = asyncio.Event()
+        calls = []
+
+        async def compute():
+            calls.append(None)
+            if len(calls) > 1:
+                await hang.wait()
+            return b"value"
+
+        await cache.get_or_compute("products", "products", {}, compute)
+        await asyncio.sleep(0.02)
+        await cache.get_or_compute("products", "products", {}, compute)
+        task = next(iter(cache._refresh_tasks))
+        await cache.close()
+        assert task.cancelled()
+    asyncio.run(run())
+
+def test_disabled_cache_always_computes():
+    async def run():
+        cache = QueryCache(None)
+        compute = Counter()
+        await cache.get_or_compute("products", "products", {}, compute)
+        await cache.get_or_compute("products", "products", {}, compute)
+        await cache.invalidate("products")
+        assert compute.calls == 2
+        assert not cache.stats()["enabled"]
+    asyncio.run(run())